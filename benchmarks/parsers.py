@@ -0,0 +1,258 @@
+"""
+Microbenchmarks of the timeline parsers on synthetic pages built from the twitter/twitter.txt TweetDetail dump.
+Runs offline: UserTweets, TweetDetail and SearchTimeline (People) responses are generated deterministically,
+serialised once, and a pool of distinct pages is cycled until every size (number of entries) is reached,
+so memory stays bounded by the pool while throughput is measured at 1k-100k entries.
+Decoding is measured with the stdlib json and orjson (when installed), parsing on pre-decoded pages.
+
+    python benchmarks/parsers.py
+    python benchmarks/parsers.py --sizes 1000 10000 --out before.json
+    python benchmarks/parsers.py --compare before.json
+
+Results (seconds, entries per second, tracemalloc peak and retained bytes per page) are written as json with
+the commit they were measured on, so runs on two commits can be compared with --compare.
+"""
+import argparse
+import copy
+import gc
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from twitter.scraper import parse_entries, parse_tweet
+try:
+    from twitter.scraper import parse_users
+    USERS_PARSER = "twitter.scraper.parse_users"
+except ImportError:
+    # Only for commits before parse_users existed, so the SearchTimeline cases can be compared against them.
+    # A copy of the user loop of search_people in twitter/scraper.py at the baseline commit, which
+    # parse_users was split out of; it is frozen on purpose and is never used when parse_users exists.
+    USERS_PARSER = "benchmarks.parsers fallback (baseline search_people)"
+
+    def parse_users(entries: List[dict]) -> Tuple[List[Dict[str, Any]], str]:
+        cursor_bottom = entries[-1]['content']['value']
+        users = []
+        for entry in entries:
+            if entry['entryId'][0] != 'u': # e.g. user-\d+
+                continue
+            result = entry['content']['itemContent']['user_results']['result']
+            name = result['core']['name'] if 'name' in result['core'] else ""
+            if not name: continue
+            legacy = result['legacy']
+            users.append({
+                'name': name,
+                'screen_name': result['core']['screen_name'],
+                'user_id': result['rest_id'],
+                'description': legacy['description'],
+                'location': result['location']['location'],
+                'followers_count': legacy['followers_count'],
+                'friends_count': legacy['friends_count'],
+                'favourites_count': legacy['favourites_count'],
+                'is_blue_verified': result['is_blue_verified'],
+            })
+        return users, cursor_bottom
+from twitter.utils import tweets_to_json, stringify_tweet
+
+try:
+    import orjson
+except ImportError: # the orjson cases are skipped
+    orjson = None
+
+FIXTURE_PATH = ROOT / "twitter" / "twitter.txt"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+PAGE_SIZE = 20 # entries per page, as UserTweets, TweetDetail and SearchTimeline send them
+POOL_PAGES = 50 # distinct pages generated per kind, cycled to reach a size
+BASE_ID = 1_975_000_000_000_000_000
+DECODERS = {"json": json.loads}
+if orjson is not None:
+    DECODERS["orjson"] = orjson.loads
+
+def load_templates() -> Tuple[List[dict], List[dict], dict, dict]:
+    "(conversation thread entries, tweet results, cursor-top entry, cursor-bottom entry) from the dump"
+    entries = json.loads(FIXTURE_PATH.read_text(encoding="utf-8"))
+    threads = [entry for entry in entries if entry["entryId"].startswith("conversationthread")]
+    results = [thread["content"]["items"][0]["item"]["itemContent"]["tweet_results"]["result"] for thread in threads]
+    cursor_top = next(entry for entry in entries if entry["entryId"].startswith("cursor-top"))
+    cursor_bottom = next(entry for entry in entries if entry["entryId"].startswith("cursor-bottom"))
+    return threads, results, cursor_top, cursor_bottom
+
+def _tweet_result(template: dict, tweet_id: int, rng: random.Random) -> dict:
+    result = copy.deepcopy(template)
+    result["rest_id"] = str(tweet_id)
+    legacy = result["legacy"]
+    legacy["id_str"] = str(tweet_id)
+    legacy["full_text"] = f"{legacy['full_text']} #{tweet_id % 100_000}"
+    legacy["favorite_count"] = rng.randint(0, 5_000)
+    legacy["reply_count"] = rng.randint(0, 500)
+    return result
+
+def make_pages(kind: str, pages: int = POOL_PAGES, page_size: int = PAGE_SIZE, seed: int = 0) -> List[dict]:
+    "pages decoded responses of an endpoint: UserTweets, TweetDetail or SearchTimeline (People)"
+    threads, results, cursor_top, cursor_bottom = load_templates()
+    rng = random.Random(seed)
+    responses = []
+    for page in range(pages):
+        entries = [copy.deepcopy(cursor_top)] if kind != "SearchTimeline" else []
+        for i in range(page_size):
+            n = page * page_size + i
+            tweet_id = BASE_ID - n * 4_194_304 # one tweet per ms going back in time
+            result = _tweet_result(results[n % len(results)], tweet_id, rng)
+            if kind == "TweetDetail":
+                entry = copy.deepcopy(threads[n % len(threads)])
+                entry["entryId"] = f"conversationthread-{tweet_id}"
+                item = entry["content"]["items"][0]
+                item["entryId"] = f"conversationthread-{tweet_id}-tweet-{tweet_id}"
+                item["item"]["itemContent"]["tweet_results"]["result"] = result
+            elif kind == "UserTweets":
+                item_content = copy.deepcopy(threads[n % len(threads)]["content"]["items"][0]["item"]["itemContent"])
+                item_content["tweet_results"]["result"] = result
+                entry = {"entryId": f"tweet-{tweet_id}", "sortIndex": str(tweet_id), "content": {"entryType": "TimelineTimelineItem", "__typename": "TimelineTimelineItem", "itemContent": item_content}}
+            else:
+                user = result["core"]["user_results"]["result"]
+                user["rest_id"] = str(10_000_000 + n)
+                user["core"]["screen_name"] = f"user{n}"
+                user["legacy"]["followers_count"] = rng.randint(0, 1_000_000)
+                entry = {"entryId": f"user-{user['rest_id']}", "sortIndex": str(tweet_id), "content": {"entryType": "TimelineTimelineItem", "__typename": "TimelineTimelineItem", "itemContent": {"itemType": "TimelineUser", "__typename": "TimelineUser", "user_results": {"result": user}, "userDisplayType": "User"}}}
+            entries.append(entry)
+        bottom = copy.deepcopy(cursor_bottom)
+        bottom["content"]["value"] = f"{bottom['content']['value']}-{page}"
+        entries.append(bottom)
+        instructions = [{"type": "TimelineAddEntries", "entries": entries}]
+        if kind == "TweetDetail":
+            responses.append({"data": {"threaded_conversation_with_injections_v2": {"instructions": instructions}}})
+        elif kind == "UserTweets":
+            responses.append({"data": {"user": {"result": {"__typename": "User", "timeline": {"timeline": {"instructions": [{"type": "TimelineClearCache"}] + instructions}}}}}})
+        else:
+            responses.append({"data": {"search_by_raw_query": {"search_timeline": {"timeline": {"instructions": instructions}}}}})
+    return responses
+
+def page_entries(kind: str, data: dict) -> List[dict]:
+    "The entries of a decoded response, as the scraper finds them"
+    if kind == "TweetDetail":
+        instructions = data["data"]["threaded_conversation_with_injections_v2"]["instructions"]
+    elif kind == "UserTweets":
+        instructions = data["data"]["user"]["result"]["timeline"]["timeline"]["instructions"]
+    else:
+        return data["data"]["search_by_raw_query"]["search_timeline"]["timeline"]["instructions"][-1]["entries"]
+    return next(instruction["entries"] for instruction in instructions if instruction["type"] == "TimelineAddEntries")
+
+def build_cases() -> Dict[str, Tuple[List[Any], Callable[[Any], Any]]]:
+    "name -> (pool of page inputs, function over one page); every page holds PAGE_SIZE entries"
+    cases = {}
+    tweets = []
+    for kind in ("UserTweets", "TweetDetail", "SearchTimeline"):
+        pages = make_pages(kind)
+        bodies = [json.dumps(page, ensure_ascii=False).encode("utf-8") for page in pages]
+        entries = [page_entries(kind, page) for page in pages]
+        parse = (lambda e: parse_users(e)) if kind == "SearchTimeline" else (lambda e: parse_entries(e))
+        for name, loads in DECODERS.items():
+            cases[f"{kind}/decode/{name}"] = (bodies, loads)
+            cases[f"{kind}/decode+parse/{name}"] = (bodies, lambda body, kind=kind, loads=loads, parse=parse: parse(page_entries(kind, loads(body))))
+        cases[f"{kind}/parse"] = (entries, parse)
+        if kind == "UserTweets":
+            tweets = [parse_entries(e)[0] for e in entries]
+            results = [[entry["content"]["itemContent"]["tweet_results"]["result"] for entry in e if entry["entryId"].startswith("tweet")] for e in entries]
+            cases["parse_tweet"] = (results, lambda page: [parse_tweet(result) for result in page])
+    cases["tweets_to_json"] = (tweets, tweets_to_json)
+    cases["stringify_tweet"] = (tweets, lambda page: [stringify_tweet(tweet) for tweet in page])
+    return cases
+
+def time_case(pool: List[Any], fn: Callable[[Any], Any], entries: int, repeat: int) -> List[float]:
+    "Seconds per pass over entries (pages of the pool, cycled), repeat passes"
+    pages = -(-entries // PAGE_SIZE)
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for i in range(pages):
+            fn(pool[i % len(pool)])
+        runs.append(time.perf_counter() - start)
+    return runs
+
+def trace_case(pool: List[Any], fn: Callable[[Any], Any]) -> Dict[str, float]:
+    "tracemalloc peak and retained (the result) bytes per page, averaged over the pool"
+    peaks, retained = [], []
+    for page in pool:
+        gc.collect()
+        tracemalloc.start()
+        result = fn(page)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        peaks.append(peak)
+        retained.append(current)
+    return {"peak_bytes_per_page": statistics.mean(peaks), "retained_bytes_per_page": statistics.mean(retained)}
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run(sizes: List[int], repeat: int, only: Optional[str] = None) -> Dict[str, Any]:
+    cases = build_cases()
+    results = {}
+    for name, (pool, fn) in cases.items():
+        if only and only not in name:
+            continue
+        fn(pool[0]) # warm up
+        memory = trace_case(pool, fn)
+        for size in sizes:
+            runs = time_case(pool, fn, size, repeat)
+            best = min(runs)
+            results[f"{name}@{size}"] = {
+                "case": name, "entries": size, "seconds": best, "median_seconds": statistics.median(runs),
+                "entries_per_second": size / best if best else 0.0, **memory,
+            }
+            print(f"{name:<36} {size:>7} entries  {best * 1000:>10.1f} ms  {size / best if best else 0:>12,.0f} entries/s  peak {memory['peak_bytes_per_page'] / 1024:>8.1f} KiB/page")
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "orjson": orjson.__version__ if orjson is not None else None,
+        "users_parser": USERS_PARSER,
+        "page_size": PAGE_SIZE,
+        "repeat": repeat,
+        "results": results,
+    }
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]):
+    "Throughput of every case against a baseline run, > 1 is faster"
+    print(f"\n{current['commit']} against {baseline['commit']}")
+    for key, result in current["results"].items():
+        before = baseline["results"].get(key)
+        if not before or not before["entries_per_second"]:
+            continue
+        speedup = result["entries_per_second"] / before["entries_per_second"]
+        memory = result["peak_bytes_per_page"] / before["peak_bytes_per_page"] if before["peak_bytes_per_page"] else float("nan")
+        print(f"{key:<44} x{speedup:>6.2f} throughput  x{memory:>6.2f} peak memory")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the timeline parsers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="entries per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes per size, the best is reported")
+    parser.add_argument("--only", help="only run cases whose name contains this")
+    parser.add_argument("--out", help=f"results json, defaults to {RESULTS_DIR.relative_to(ROOT)}/<commit>.json")
+    parser.add_argument("--compare", help="results json of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.repeat, args.only)
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{report['commit']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {out}")
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()))
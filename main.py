@@ -12,10 +12,11 @@ import time
 import operator
 import os
 import random
+import math
 from twitter import *
 import json
 import pandas as pd
-from sentiment_analysis import calculate_overall_sentiment
+from sentiment_analysis import calculate_overall_sentiment_adaptive, unique_comments
 
 
 
@@ -174,8 +175,7 @@ def user_recon_query(state: OverallState) -> OverallState:
         query, cursor = update["query_queue"][0]
         if query in state["queried"]: continue
         try:
-            search_results = search_people(query=query, cursor=cursor)[0]
-            time.sleep(random.random() * 2)
+            search_results = search_people(query=query, cursor=cursor)[0] # paced by the scraper's rate limiter
             update["search_results"].append(search_results)
             update["queried"].add(query)
             update["query_queue"].pop(0)
@@ -183,10 +183,12 @@ def user_recon_query(state: OverallState) -> OverallState:
         except Exception as e:
             error_code = str(e)[:3]
             print(f'{Fore.RED}Error fetching "{query}" {f"with cursor {cursor}" if cursor else ""}: {e}{Style.RESET_ALL}')
-            if error_code == '429':  # Rate limit
+            if not session_pool.live(): # every account is retired (or none is configured), waiting will not help
+                return update
+            if error_code == '429':  # Rate limit, wait exactly until the window resets
                 update["node_before_timeout"] = "user_recon_query"
-                update["timeout_duration"] = 60  # Longer timeout for rate limits
-                print(f'{Fore.YELLOW}Rate limit detected. Waiting 60 seconds before retry...{Style.RESET_ALL}')
+                update["timeout_duration"] = max(1, round(session_pool.seconds_until_reset("SearchTimeline")))
+                print(f'{Fore.YELLOW}Rate limit detected. Waiting {update["timeout_duration"]} seconds before retry...{Style.RESET_ALL}')
             else:  # Random errors
                 update["node_before_timeout"] = "user_recon_query"
                 update["timeout_duration"] = 5
@@ -195,6 +197,8 @@ def user_recon_query(state: OverallState) -> OverallState:
     return update
 
 def route_after_user_recon_query(state: OverallState) -> str:
+    if not session_pool.live():
+        return "end"
     if state["node_before_timeout"] == "user_recon_query":
         return "timeout_node"
     if len(state["search_results"]) > 0:
@@ -271,6 +275,8 @@ def analyse_users(state: OverallState) -> OverallState:
     """Analyses the tweets and comments of a user"""
     users_to_analyse = state.get("accounts_to_analyse", set())
     
+    # one request budget for the whole run, shared out between the users by what their tweets are worth
+    scheduler = RequestScheduler(users=[user[1] for user in users_to_analyse])
     # Produce a comprehensive final report based on all user analyses
     items = [{
          'user_id':user[0],
@@ -280,13 +286,17 @@ def analyse_users(state: OverallState) -> OverallState:
          'research_period':state["research_period"], 
          'research_requirements':state["research_requirements"], 
          'minimum_tweets_to_collect':state["minimum_tweets_to_collect"],
-         'minimum_accounts_to_analyse':state["minimum_accounts_to_analyse"]
+         'minimum_accounts_to_analyse':state["minimum_accounts_to_analyse"],
+         'scheduler':scheduler
          } for user in users_to_analyse]
     
-    results = analyse_user_app.batch(items, config={'max_concurrency': 2}) # 2 is the max concurrency to prevent rate limit
+    # sessions are thread-safe and the pool paces every account, so concurrency only has to keep them all busy
+    results = analyse_user_app.batch(items, config={'max_concurrency': max(4, 2 * len(session_pool))})
     for result in results:
         print(f"{Fore.GREEN}{result['user_screen_name']}: {result['tweet_sentiment']}{Style.RESET_ALL}")
     user_reports = {result['user_screen_name']: result['tweet_sentiment'] for result in results} 
+    spend = scheduler.report()
+    print(f"{Fore.GREEN}Requests: {json.dumps(spend)}{Style.RESET_ALL}")
     
     # Generate an overall report based on the user reports
     system_prompt = f"""
@@ -311,6 +321,9 @@ def analyse_users(state: OverallState) -> OverallState:
             f.write(f"## {user_screen_name}\n")
             f.write(json.dumps(tweet_sentiment))
             f.write("\n")
+        f.write("# REQUESTS\n")
+        f.write(json.dumps(spend))
+        f.write("\n")
         f.write("# FINAL EVALUATION\n")
         f.write(response.content)
     
@@ -360,13 +373,24 @@ class AnalyseUserState(TypedDict):
     tweet_sentiment: List[Dict[str, Any]] # [{ 'tweet_id': tweet_id, 'sentiment_score': sentiment_score, 'summary': comment_summary }]
     top_tweets: List[str]
     llm: ChatOpenAI
+    scheduler: RequestScheduler
 
     node_before_timeout: str
+    timeout_duration: int
 
 class AnalyseTweetsResult(BaseModel):
     tweets_summary: str = Field(description="Summary of the tweets offering insights into the company and the market")
     top_tweets: List[int] = Field(description="The tweet_ids of the top 10 tweets in the json")
 
+def archive(append, *args, **kwargs):
+    """Append to tweet_archive; the archive is a side output, so a failure is reported and the run goes on"""
+    if not tweet_archive.enabled:
+        return
+    try:
+        append(*args, **kwargs)
+    except Exception as e:
+        print(f"{Fore.YELLOW}Could not archive to {tweet_archive.path}: {e}{Style.RESET_ALL}")
+
 def analyse_tweets(state: AnalyseUserState) -> AnalyseUserState:
     """Analyse users"""
     print(f"{Fore.RED}Analysing tweets for {state['user_screen_name']}{Style.RESET_ALL}")
@@ -376,14 +400,23 @@ def analyse_tweets(state: AnalyseUserState) -> AnalyseUserState:
         "node_before_timeout": ""
     }
     
+    scheduler, user = state["scheduler"], state["user_screen_name"]
+    pages = scheduler.grant(user, "UserTweets", wanted=math.ceil(state["minimum_tweets_to_collect"] / 20) + 1)
     try:
-        latest_tweets = get_user_tweets(state["user_id"], minimum_tweets=state["minimum_tweets_to_collect"], period=state["research_period"])[0]
+        with scheduler.track(user):
+            latest_tweets = refresh_user_tweets(state["user_id"], minimum_tweets=state["minimum_tweets_to_collect"], period=state["research_period"], max_pages=pages)
     except Exception as e:
+        scheduler.settle(user, "UserTweets")
+        print(f"{Fore.RED}Error fetching tweets for {state['user_screen_name']}: {e}{Style.RESET_ALL}")
+        if not session_pool.live(): # every account is retired (or none is configured), end instead of waiting
+            return update
         return {
             "node_before_timeout": "analyse_tweets",
-            "timeout_duration": 60
+            "timeout_duration": max(5, round(session_pool.seconds_until_reset("UserTweets")))
         }
     
+    scheduler.settle(user, "UserTweets", tweets=len(latest_tweets))
+    archive(tweet_archive.append_tweets, state["target_name"], latest_tweets) # keep what was scraped for later analyses and backtests
     if not latest_tweets: 
         return update
 
@@ -418,17 +451,40 @@ def analyse_comments(state: AnalyseUserState) -> AnalyseUserState:
     The sentiment score should be a number between 0 and 1. 0 is the most negative and 1 is the most positive.
     The summary should be a few sentences that capture the main points of the comments.
     The sentiment score should be calculated using the comments.
+    Comments posted several times (e.g. copy-pasted replies) are shown once with the number of copies.
     """
-    for tweet_id in state["top_tweets"][:5]:
-        print(f"{Fore.CYAN}Analysing comments for {tweet_id}{Style.RESET_ALL}")
-        comments = get_comments(tweet_id, minimum_comments=100)[0]
-        if len(comments) <= 1: continue
-        print(f"{Fore.CYAN}Found {len(comments)} comments for {tweet_id}{Style.RESET_ALL}")
+    # the top tweets most worth their comments first, and a share of the run's TweetDetail budget by what they are worth
+    scheduler, user = state["scheduler"], state["user_screen_name"]
+    stored = {tweet.tweet_id: tweet for tweet in tweet_store.load(state["user_id"])}
+    known = [stored[str(tweet_id)] for tweet_id in state["top_tweets"] if str(tweet_id) in stored]
+    values = dict(zip((tweet.tweet_id for tweet in known), expected_values(known).tolist())) if known else {}
+    top_tweets = sorted(state["top_tweets"], key=lambda tweet_id: -values.get(str(tweet_id), 0.0))[:5]
+    # tweets missing from the store count as an average one, and nothing to go on at all as a neutral 1.0,
+    # otherwise the grant floors to a single request for all of them
+    neutral = (sum(values.values()) / len(values) if values else 0.0) or 1.0
+    value = sum(values.get(str(tweet_id), neutral) for tweet_id in top_tweets) or neutral * len(top_tweets)
+    requests = scheduler.grant(user, "TweetDetail", wanted=6 * len(top_tweets), value=value)
+    if not requests:
+        print(f"{Fore.CYAN}No TweetDetail budget left for {user}{Style.RESET_ALL}")
+        scheduler.settle(user, "TweetDetail")
+        return update
+    print(f"{Fore.CYAN}Analysing comments for {top_tweets} ({requests} requests){Style.RESET_ALL}")
+    # page through the comments of all top tweets together, scoring every round as one stream, until each
+    # tweet's sentiment is clear; contested tweets get the requests clear-cut ones did not need
+    fetch_pages = lambda cursors: fetch_comments_pages(cursors, exclude_focal=True, stop_at_spam=True)
+    with scheduler.track(user):
+        results = calculate_overall_sentiment_adaptive(top_tweets, fetch_pages, max_requests=requests)
+    scheduler.settle(user, "TweetDetail", comments=sum(len(comments) for comments, _, _ in results.values()))
+    for tweet_id in top_tweets:
+        cleaned_comments, sentiment_score, sampling = results[str(tweet_id)]
+        if not cleaned_comments: continue
+        print(f"{Fore.CYAN}Found {len(cleaned_comments)} comments for {tweet_id} in {sampling['pages']} pages ({sampling['stopped']}, ±{sampling['width'] / 2:.3f}){Style.RESET_ALL}")
+        archive(tweet_archive.append_comments, state["target_name"], tweet_id, cleaned_comments)
+        archive(tweet_archive.append_scores, state["target_name"], tweet_id, cleaned_comments, sampling["scores"], sampling["weights"], scorer="roberta+vader")
     
-        cleaned_comments, sentiment_score = calculate_overall_sentiment(comments[1:]) # exclude the tweet itself
         messages = [
         SystemMessage(content=system_prompt),
-        HumanMessage(content=f"{json.dumps(cleaned_comments)}")
+        HumanMessage(content=f"{json.dumps([{**comment.to_dict(), 'copies': copies} if copies > 1 else comment.to_dict() for comment, copies in unique_comments(cleaned_comments)])}")
         ]
         response = state["llm"].invoke(messages)
         sentiment = {
@@ -484,6 +540,8 @@ main_workflow.add_edge("context_setting", "user_recon_query")
 main_workflow.add_conditional_edges("user_recon_query", route_after_user_recon_query, {
     "timeout_node": "timeout_node",
     "user_recon_select": "user_recon_select",
+    "user_recon_query": "user_recon_query",
+    "end": END
 })
 main_workflow.add_conditional_edges("user_recon_select", route_after_user_recon_select, {
     "user_recon_query": "user_recon_query",
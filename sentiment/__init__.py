@@ -0,0 +1,25 @@
+import importlib
+
+from .batching import *
+from .cache import *
+from .cascade import *
+from .vader import *
+from .routing import *
+from .dedup import *
+from .sampling import *
+
+# the model backends need torch and transformers, so they are imported on first use and
+# the pure-Python parts (batching, caching, VADER, ...) stay importable without them
+_LAZY = {
+    "backends": ("MODEL_PATH", "BACKENDS", "ONNX_CACHE_DIR", "MAX_LENGTH", "default_device", "probs_to_scores", "SentimentModel", "compare_backends"),
+    "workers": ("InferencePool",),
+    "pipeline": ("DEFAULT_PIPELINE_WORKERS", "DEFAULT_QUEUE_DEPTH", "DEFAULT_CHUNK_SIZE", "StageTimings", "pipelined", "PipelinedModel"),
+}
+_LAZY_NAMES = {name: module for module, names in _LAZY.items() for name in names}
+
+def __getattr__(name: str):
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_LAZY_NAMES[name]}", __name__), name)
+    globals()[name] = value
+    return value
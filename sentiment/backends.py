@@ -0,0 +1,188 @@
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from .batching import plan_batches, padding_stats, DEFAULT_MAX_TOKENS, DEFAULT_MAX_BATCH_SIZE
+
+try:
+    import onnxruntime
+except ImportError: # only needed for the "onnx" backend
+    onnxruntime = None
+
+MODEL_PATH = "cardiffnlp/twitter-roberta-base-sentiment-latest"
+BACKENDS = ("torch", "torch-int8", "onnx")
+ONNX_CACHE_DIR = Path(__file__).parent / ".cache" / "onnx"
+MAX_LENGTH = 256
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def probs_to_scores(probs: np.ndarray) -> np.ndarray:
+    """
+    Map class probabilities (batch, num_labels) to continuous scores in [-1, 1]:
+    score = prob_pos - prob_neg
+    For models with 3 labels arranged [negative, neutral, positive].
+    """
+    # mapping - assumes label order is neg, (neu,) pos
+    # if model uses different label order, you must reorder accordingly
+    if probs.shape[1] in (2, 3):
+        return probs[:, -1] - probs[:, 0]
+    # fallback: compute (expected label index scaled) then clip to -1..1
+    labels = np.arange(probs.shape[1])
+    norm = (labels - labels.mean()) / (labels.max() - labels.min() + 1e-9)
+    return np.clip(probs @ norm, -1.0, 1.0)
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+class _LogitsOnly(torch.nn.Module):
+    "Wraps a sequence classifier so the exported ONNX graph has plain tensor inputs and outputs"
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+class SentimentModel:
+    """
+    Sentiment classifier behind a selectable inference backend, loaded on first use:
+        torch: PyTorch fp32, on the GPU when there is one
+        torch-int8: PyTorch with dynamically int8-quantized Linear layers (CPU only, also on a GPU machine)
+        onnx: ONNX Runtime, the model is exported once to sentiment/.cache/onnx
+    num_threads sets the intra-op threads of the backend (None keeps the library default).
+    """
+    def __init__(self, model_path: str = MODEL_PATH, backend: str = "torch", device: Optional[str] = None, num_threads: Optional[int] = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Invalid backend: {backend}, expected one of {BACKENDS}")
+        self.model_path = model_path
+        self.backend = backend
+        self.device = device or ("cpu" if backend == "torch-int8" else default_device())
+        if backend == "torch-int8" and self.device != "cpu":
+            raise ValueError("torch-int8 runs on the CPU only")
+        self.num_threads = num_threads
+        self.tokenizer = None
+        self.model = None
+        self.session = None
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self) -> str:
+        "Identifies the scores this model produces, quantized backends do not match fp32 exactly"
+        return self.model_path if self.backend == "torch" else f"{self.model_path}#{self.backend}"
+
+    def load(self) -> "SentimentModel":
+        with self._lock:
+            if self.tokenizer is not None:
+                return self
+            tokenizer = AutoTokenizer.from_pretrained(self.model_path, use_fast=True)
+            # a fast tokenizer reconfigures its Rust truncation/padding state whenever a call asks for different
+            # settings, which fails with "Already borrowed" while another thread tokenizes; set what tokenize()
+            # uses once here, so the concurrent calls of the pipeline workers only ever read it
+            tokenizer([""], truncation=True, max_length=MAX_LENGTH)
+            if self.backend == "onnx":
+                self.session = self._onnx_session()
+            else:
+                if self.num_threads:
+                    torch.set_num_threads(self.num_threads)
+                model = AutoModelForSequenceClassification.from_pretrained(self.model_path)
+                model.eval()
+                if self.backend == "torch-int8":
+                    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                self.model = model.to(self.device)
+            self.tokenizer = tokenizer
+        return self
+
+    def _onnx_session(self):
+        if onnxruntime is None:
+            raise ImportError("The onnx backend needs onnxruntime: pip install onnxruntime")
+        path = ONNX_CACHE_DIR / (self.model_path.replace('/', '--') + ".onnx")
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_path).eval()
+            dummy = torch.ones((1, 8), dtype=torch.long)
+            tmp = path.with_suffix(".tmp")
+            torch.onnx.export(
+                _LogitsOnly(model), (dummy, dummy), str(tmp),
+                input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"}, "logits": {0: "batch"}},
+                opset_version=17,
+            )
+            tmp.replace(path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if self.device == "cuda" else ["CPUExecutionProvider"]
+        return onnxruntime.InferenceSession(str(path), options, providers=providers)
+
+    def tokenize(self, texts: List[str]) -> Dict[str, List[List[int]]]:
+        "Token ids without padding, padding depends on the batch"
+        return self.load().tokenizer(list(texts), truncation=True, max_length=MAX_LENGTH)
+
+    def pad(self, features: Dict[str, List[List[int]]]) -> Dict[str, Any]:
+        "One batch of unpadded features from tokenize as padded input tensors for forward"
+        return self.load().tokenizer.pad(features, return_tensors="np" if self.backend == "onnx" else "pt")
+
+    def forward(self, padded: Dict[str, Any]) -> np.ndarray:
+        "Logits for one padded batch"
+        if self.backend == "onnx":
+            inputs = {"input_ids": padded["input_ids"].astype(np.int64), "attention_mask": padded["attention_mask"].astype(np.int64)}
+            return self.session.run(["logits"], inputs)[0]
+        with torch.inference_mode():
+            padded = {k: v.to(self.device) for k, v in padded.items()}
+            return self.model(**padded).logits.float().cpu().numpy()
+
+    def logits(self, features: Dict[str, List[List[int]]]) -> np.ndarray:
+        "Logits for one batch of unpadded features from tokenize"
+        return self.forward(self.pad(features))
+
+    def scores(self, texts: List[str], max_tokens: int = DEFAULT_MAX_TOKENS, batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> Tuple[List[float], Dict[str, Any]]:
+        """
+        Scores in [-1, 1] in the order of texts, and the padding_stats of the batch plan.
+        Texts are tokenized once, batched by token length with at most max_tokens padded tokens
+        (and batch_size texts) per forward pass, and scattered back into place.
+        """
+        scores = np.zeros(len(texts))
+        lengths = []
+        if texts:
+            enc = self.tokenize(texts)
+            lengths = [len(ids) for ids in enc["input_ids"]]
+        batches = plan_batches(lengths, max_tokens, batch_size)
+        for batch in batches:
+            logits = self.logits({key: [enc[key][i] for i in batch] for key in enc.keys()})
+            scores[batch] = probs_to_scores(_softmax(logits))
+        return scores.tolist(), padding_stats(lengths, batches)
+
+def compare_backends(texts: List[str], backend: str = "torch-int8", reference: str = "torch", model_path: str = MODEL_PATH, num_threads: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Accuracy and speed of a backend against the fp32 reference on the same texts (ideally real comments):
+    score differences, how often both agree on the sign of the score, and the speedup.
+    Both run on the CPU so the speedup is the one our inference boxes would see.
+    """
+    models = {name: SentimentModel(model_path, name, device="cpu", num_threads=num_threads).load() for name in (reference, backend)}
+    results = {}
+    for name, model in models.items():
+        model.scores(texts[:8]) # warm up
+        start = time.perf_counter()
+        scores, _ = model.scores(texts)
+        results[name] = (np.asarray(scores), time.perf_counter() - start)
+    (ref_scores, ref_seconds), (scores, seconds) = results[reference], results[backend]
+    diff = np.abs(scores - ref_scores)
+    return {
+        "texts": len(texts),
+        "backend": backend,
+        "reference": reference,
+        "max_abs_diff": float(diff.max()) if len(diff) else 0.0,
+        "mean_abs_diff": float(diff.mean()) if len(diff) else 0.0,
+        "sign_agreement": float(np.mean(np.sign(np.round(scores, 1)) == np.sign(np.round(ref_scores, 1)))) if len(diff) else 1.0,
+        "reference_seconds": ref_seconds,
+        "backend_seconds": seconds,
+        "speedup": ref_seconds / seconds if seconds else float("nan"),
+    }
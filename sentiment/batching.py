@@ -0,0 +1,61 @@
+from typing import List, Dict, Any, Sequence
+
+import numpy as np
+
+DEFAULT_MAX_TOKENS = 8192 # padded tokens per forward pass
+DEFAULT_MAX_BATCH_SIZE = 128
+MIN_BATCH_EFFICIENCY = 0.8 # start a new batch rather than pad a batch below this share of real tokens
+FIXED_BATCH_SIZE = 32 # the old arrival-order batching, kept as the baseline in padding_stats
+
+def plan_batches(lengths: Sequence[int], max_tokens: int = DEFAULT_MAX_TOKENS, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, min_efficiency: float = MIN_BATCH_EFFICIENCY) -> List[np.ndarray]:
+    """
+    Group texts into batches by token length.
+    Texts are sorted by length and cut into batches whose padded size (texts * longest text) stays within
+    max_tokens, so one-word replies are not padded to the length of the longest rant and short texts go
+    in large batches, long texts in small ones. A batch is also cut when adding a longer text would drop
+    its share of real tokens below min_efficiency. Returns arrays of indices into lengths.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order = np.argsort(lengths, kind="stable")
+    batches = []
+    start = 0
+    real = 0
+    for end in range(len(order)):
+        length = lengths[order[end]]
+        size = end - start + 1 # ascending order: the text at end is the longest so far
+        if size > 1 and (size > max_batch_size or size * length > max_tokens or real + length < min_efficiency * size * length):
+            batches.append(order[start:end])
+            start, size, real = end, 1, 0
+        real += length
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+def _padded_tokens(lengths: np.ndarray, batches: List[np.ndarray]) -> int:
+    return int(sum(len(batch) * lengths[batch].max() for batch in batches if len(batch)))
+
+def padding_stats(lengths: Sequence[int], batches: List[np.ndarray]) -> Dict[str, Any]:
+    """
+    How much of the compute of a batch plan goes to real tokens rather than padding,
+    next to the same numbers for fixed batches of FIXED_BATCH_SIZE in arrival order.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    real = int(lengths.sum())
+    padded = _padded_tokens(lengths, batches)
+    fixed = _padded_tokens(lengths, [np.arange(i, min(i + FIXED_BATCH_SIZE, len(lengths))) for i in range(0, len(lengths), FIXED_BATCH_SIZE)])
+    return {
+        "texts": len(lengths),
+        "batches": len(batches),
+        "real_tokens": real,
+        "padded_tokens": padded,
+        "padding_efficiency": real / padded if padded else 1.0,
+        "fixed_padded_tokens": fixed,
+        "fixed_padding_efficiency": real / fixed if fixed else 1.0,
+    }
+
+def merge_padding_stats(stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    "Combine the padding_stats of batch plans that ran side by side, e.g. on several workers"
+    merged = {key: sum(s[key] for s in stats) for key in ("texts", "batches", "real_tokens", "padded_tokens", "fixed_padded_tokens")}
+    merged["padding_efficiency"] = merged["real_tokens"] / merged["padded_tokens"] if merged["padded_tokens"] else 1.0
+    merged["fixed_padding_efficiency"] = merged["real_tokens"] / merged["fixed_padded_tokens"] if merged["fixed_padded_tokens"] else 1.0
+    return merged
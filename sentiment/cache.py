@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Union, Callable, Sequence
+
+import numpy as np
+import xxhash
+
+SCORE_CACHE_PATH = Path(__file__).parent / ".cache" / "scores.db"
+DEFAULT_MEMORY_ENTRIES = 200_000
+SQLITE_MAX_PARAMS = 900 # stay under SQLite's bound-parameter limit
+
+class ScoreCache:
+    """
+    Sentiment scores keyed by an xxh3 hash of the model id and the cleaned text, so copy-pasted replies
+    and texts seen in earlier runs are scored once. An in-process LRU sits in front of a SQLite table
+    that persists across runs (disable it with persist=False).
+    """
+    def __init__(self, path: Union[str, Path] = SCORE_CACHE_PATH, max_memory_entries: int = DEFAULT_MEMORY_ENTRIES, persist: bool = True):
+        self.path = Path(path)
+        self.max_memory_entries = max_memory_entries
+        self.persist = persist
+        self._memory: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS scores (key INTEGER PRIMARY KEY, score REAL NOT NULL)")
+        return self._db
+
+    @staticmethod
+    def key(model_id: str, text: str) -> int:
+        # signed, to fit SQLite's INTEGER
+        value = xxhash.xxh3_64_intdigest(f"{model_id}\0{text}".encode("utf-8", "surrogatepass"))
+        return value - (1 << 64) if value >= 1 << 63 else value
+
+    def _remember(self, key: int, score: float):
+        self._memory[key] = score
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model_id: str, texts: Sequence[str]) -> np.ndarray:
+        "Cached scores for texts, nan where a text has not been scored by the model yet"
+        keys = [self.key(model_id, text) for text in texts]
+        scores = np.full(len(keys), np.nan)
+        with self._lock:
+            unresolved: Dict[int, List[int]] = {}
+            for i, key in enumerate(keys):
+                score = self._memory.get(key)
+                if score is None:
+                    unresolved.setdefault(key, []).append(i)
+                else:
+                    self._memory.move_to_end(key)
+                    scores[i] = score
+            if unresolved and self.persist:
+                db = self._connect()
+                pending = list(unresolved)
+                for start in range(0, len(pending), SQLITE_MAX_PARAMS):
+                    chunk = pending[start : start + SQLITE_MAX_PARAMS]
+                    rows = db.execute(f"SELECT key, score FROM scores WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                    for key, score in rows:
+                        self._remember(key, score)
+                        scores[unresolved[key]] = score
+        return scores
+
+    def put_many(self, model_id: str, texts: Sequence[str], scores: Sequence[float]):
+        rows = [(self.key(model_id, text), float(score)) for text, score in zip(texts, scores)]
+        with self._lock:
+            for key, score in rows:
+                self._remember(key, score)
+            if self.persist and rows:
+                db = self._connect()
+                db.execute("BEGIN")
+                db.executemany("INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)", rows)
+                db.execute("COMMIT")
+
+    def get_or_compute(self, model_id: str, texts: Sequence[str], compute: Callable[[List[str]], Sequence[float]]) -> List[float]:
+        "Scores for texts, calling compute only once per distinct text that is not cached"
+        scores = self.get_many(model_id, texts)
+        missing = np.flatnonzero(np.isnan(scores))
+        with self._lock:
+            self.hits += len(scores) - len(missing)
+            self.misses += len(missing)
+        if len(missing):
+            # duplicates within the call are computed once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(unique_texts, compute(unique_texts)))
+            self.put_many(model_id, unique_texts, [computed[text] for text in unique_texts])
+            for i in missing:
+                scores[i] = computed[texts[i]]
+        return scores.tolist()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.persist:
+                self._connect().execute("DELETE FROM scores")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "memory_entries": len(self._memory)}
@@ -0,0 +1,51 @@
+import re
+import threading
+from typing import Optional, Dict, Any, List, Sequence
+
+import numpy as np
+
+DEFAULT_GATES = { # a text goes to the transformer when VADER's verdict trips any of these
+    "neutral": 0.4, # |compound| below this is too weak to trust
+    "mixed": 0.15, # positive and negative shares both at least this: conflicting cues
+    "coverage": 0.85, # neutral share above this: VADER knew too few of the words
+    # irony VADER would read literally
+    "sarcasm": r"(/s\b|🙄|🤡|😏|🙃|🤣|\byeah,? right\b|\bsure,? jan\b|\boh (great|wonderful|sure|good)\b|\bwhat could (possibly )?go wrong\b|\bthanks a lot\b|[!?]*\?![!?]*)",
+}
+
+def transformer_mask(texts: Sequence[str], polarity: Sequence[Dict[str, float]], gates: Optional[Dict[str, Any]] = None) -> np.ndarray:
+    """
+    Which texts VADER cannot be trusted with on its own, from its polarity_scores (neg/neu/pos/compound).
+    Gates missing from gates fall back to DEFAULT_GATES, a gate set to None is disabled.
+    """
+    gates = {**DEFAULT_GATES, **(gates or {})}
+    compound = np.fromiter((p["compound"] for p in polarity), dtype=float, count=len(polarity))
+    pos = np.fromiter((p["pos"] for p in polarity), dtype=float, count=len(polarity))
+    neg = np.fromiter((p["neg"] for p in polarity), dtype=float, count=len(polarity))
+    neu = np.fromiter((p["neu"] for p in polarity), dtype=float, count=len(polarity))
+    mask = np.zeros(len(polarity), dtype=bool)
+    if gates["neutral"] is not None:
+        mask |= np.abs(compound) < gates["neutral"]
+    if gates["mixed"] is not None:
+        mask |= (pos >= gates["mixed"]) & (neg >= gates["mixed"])
+    if gates["coverage"] is not None:
+        mask |= neu > gates["coverage"]
+    if gates["sarcasm"]:
+        sarcasm = re.compile(gates["sarcasm"], re.IGNORECASE)
+        mask |= np.fromiter((bool(sarcasm.search(text)) for text in texts), dtype=bool, count=len(texts))
+    return mask
+
+class CascadeStats:
+    "Running count of the texts the cascade answered with VADER alone"
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.texts = 0
+        self.skipped = 0
+
+    def add(self, texts: int, skipped: int):
+        with self._lock:
+            self.texts += texts
+            self.skipped += skipped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"texts": self.texts, "skipped": self.skipped, "skip_fraction": self.skipped / self.texts if self.texts else 0.0}
@@ -0,0 +1,90 @@
+import re
+from typing import Optional, Dict, Any, List, Tuple, Sequence
+
+import numpy as np
+import xxhash
+
+DEFAULT_DEDUP = {
+    "threshold": 0.8, # estimated Jaccard similarity of the shingle sets at which two texts are the same reply
+    "num_perm": 128, # MinHash permutations
+    "bands": 16, # LSH bands of num_perm / bands rows, 16 x 8 makes pairs above ~0.7 likely candidates
+    "shingle": 5, # characters per shingle
+}
+_PRIME = (1 << 32) - 5 # largest prime below 2^32
+_SIGNATURE_CHUNK = 1 << 16 # shingles hashed against all permutations at once
+_WHITESPACE = re.compile(r"\s+")
+
+def _shingle_hashes(text: str, size: int) -> np.ndarray:
+    "32 bit hashes of the distinct character shingles of the normalised text"
+    text = _WHITESPACE.sub(" ", text.lower()).strip()
+    shingles = {text[i : i + size] for i in range(max(1, len(text) - size + 1))}
+    return np.fromiter((xxhash.xxh32_intdigest(shingle.encode("utf-8", "surrogatepass")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+def minhash_signatures(texts: Sequence[str], num_perm: int = DEFAULT_DEDUP["num_perm"], shingle: int = DEFAULT_DEDUP["shingle"], seed: int = 1) -> np.ndarray:
+    """
+    (len(texts), num_perm) MinHash signatures: for every permutation (a * h + b) mod p (p just below 2^32) over the
+    shingle hashes h, the minimum per text. All shingles of all texts are permuted in chunks and reduced per text.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+    hashes = [_shingle_hashes(text, shingle) for text in texts]
+    lengths = np.array([len(h) for h in hashes])
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    if not len(texts):
+        return signatures
+    flat = np.concatenate(hashes)
+    starts = np.cumsum(lengths) - lengths
+    # whole texts per chunk so reduceat never splits one
+    text = 0
+    while text < len(texts):
+        end = max(text + 1, int(np.searchsorted(starts, starts[text] + _SIGNATURE_CHUNK, side="right")))
+        end = min(end, len(texts))
+        chunk = flat[starts[text] : starts[end - 1] + lengths[end - 1]]
+        permuted = (np.outer(chunk, a) + b) % np.uint64(_PRIME) # a, b < p and h < 2^32 keep a * h + b below 2^64
+        signatures[text:end] = np.minimum.reduceat(permuted, starts[text:end] - starts[text], axis=0)
+        text = end
+    return signatures
+
+def near_duplicate_groups(texts: Sequence[str], threshold: float = DEFAULT_DEDUP["threshold"], num_perm: int = DEFAULT_DEDUP["num_perm"], bands: int = DEFAULT_DEDUP["bands"], shingle: int = DEFAULT_DEDUP["shingle"]) -> np.ndarray:
+    """
+    For every text the index of the first text it is a near duplicate of (itself when it is the first).
+    Candidate pairs share an LSH band of their MinHash signatures and are kept when the signatures agree
+    on at least threshold of the permutations; groups are the connected components of the kept pairs.
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+    signatures = minhash_signatures(texts, num_perm, shingle)
+    parent = np.arange(len(texts))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = num_perm // bands
+    for band in range(bands):
+        buckets: Dict[bytes, int] = {}
+        for i, key in enumerate(map(bytes, signatures[:, band * rows : (band + 1) * rows])):
+            first = buckets.setdefault(key, i)
+            if first == i:
+                continue
+            root_first, root_i = find(first), find(i)
+            if root_first != root_i and np.mean(signatures[first] == signatures[i]) >= threshold:
+                parent[max(root_first, root_i)] = min(root_first, root_i) # the earliest text represents the group
+    return np.array([find(i) for i in range(len(texts))], dtype=np.int64)
+
+def collapse_near_duplicates(texts: Sequence[str], **options) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (representatives, multiplicity, inverse): the index of one text per near-duplicate group in order of first
+    appearance, how many texts each stands for, and for every text the position of its representative,
+    so values computed on the representatives expand back with values[inverse].
+    """
+    groups = near_duplicate_groups(texts, **options)
+    representatives, inverse, multiplicity = np.unique(groups, return_inverse=True, return_counts=True)
+    return representatives, multiplicity, inverse
+
+def dedup_stats(multiplicity: np.ndarray) -> Dict[str, Any]:
+    texts = int(multiplicity.sum())
+    return {"texts": texts, "unique": len(multiplicity), "largest_group": int(multiplicity.max()) if len(multiplicity) else 0, "duplicate_fraction": 1 - len(multiplicity) / texts if texts else 0.0}
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterator, Sequence
+
+import numpy as np
+
+from .backends import SentimentModel, probs_to_scores, _softmax
+from .batching import plan_batches, padding_stats, merge_padding_stats, DEFAULT_MAX_TOKENS, DEFAULT_MAX_BATCH_SIZE
+
+DEFAULT_PIPELINE_WORKERS = 2
+DEFAULT_QUEUE_DEPTH = 4 # prepared chunks waiting for the model before the workers are held back
+DEFAULT_CHUNK_SIZE = 256 # texts tokenized per work item, batches are planned within a chunk
+_DONE = object()
+
+class StageTimings:
+    """
+    Seconds and items per pipeline stage, summed over calls. Worker stages add up the time of every worker.
+    "starved" is the time the consumer waited on an empty queue (preprocessing is the bottleneck),
+    "blocked" the time workers waited on a full queue (the model is the bottleneck).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = {}
+        self.items: Dict[str, int] = {}
+
+    def add(self, stage: str, seconds: float, items: int = 0):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.items[stage] = self.items.get(stage, 0) + items
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {"seconds": seconds, "items": self.items[stage], "items_per_second": self.items[stage] / seconds if seconds else 0.0}
+                for stage, seconds in self.seconds.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self.seconds.clear()
+            self.items.clear()
+
+def pipelined(items: Sequence[Any], stage: Callable[[Any], Any], workers: int = DEFAULT_PIPELINE_WORKERS, depth: int = DEFAULT_QUEUE_DEPTH, timings: Optional[StageTimings] = None) -> Iterator[Tuple[int, Any]]:
+    """
+    Run stage over items on a pool of worker threads and yield (index, result) as results come in, not in order.
+    Results go through a queue of at most depth entries: workers that get ahead of the consumer block on it,
+    so memory stays bounded by depth prepared items whatever the size of items.
+    An exception in a worker is raised in the consumer.
+    """
+    results: "queue.Queue" = queue.Queue(maxsize=max(1, depth))
+    next_item = iter(range(len(items)))
+    next_lock = threading.Lock()
+    stop = threading.Event()
+    timings = timings or StageTimings()
+
+    def work():
+        while not stop.is_set():
+            with next_lock:
+                i = next(next_item, None)
+            if i is None:
+                break
+            try:
+                result = stage(items[i])
+            except BaseException as e:
+                result = e
+            start = time.perf_counter()
+            while not stop.is_set():
+                try:
+                    results.put((i, result), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            timings.add("blocked", time.perf_counter() - start)
+        results.put(_DONE) # never blocks for long, the consumer keeps draining until every worker is done
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(max(1, min(workers, len(items))))]
+    for thread in threads:
+        thread.start()
+    running = len(threads)
+    try:
+        while running:
+            start = time.perf_counter()
+            entry = results.get()
+            timings.add("starved", time.perf_counter() - start)
+            if entry is _DONE:
+                running -= 1
+                continue
+            i, result = entry
+            if isinstance(result, BaseException):
+                raise result
+            yield i, result
+    finally:
+        stop.set()
+        while running: # unblock the workers and wait for them to finish
+            if results.get() is _DONE:
+                running -= 1
+
+class PipelinedModel:
+    """
+    SentimentModel.scores with tokenization and padding overlapped with the forward passes.
+    Texts are cut into chunks that a pool of worker threads tokenizes, plans into length batches and pads
+    (the fast tokenizers release the GIL); the padded batches wait in a bounded queue for the model, which
+    runs them in the calling thread as they arrive. Stage times are collected in timings.
+    Has the same scores() as SentimentModel so it can stand in for it.
+    """
+    def __init__(self, model: SentimentModel, workers: int = DEFAULT_PIPELINE_WORKERS, depth: int = DEFAULT_QUEUE_DEPTH, chunk_size: int = DEFAULT_CHUNK_SIZE, timings: Optional[StageTimings] = None):
+        self.model = model
+        self.workers = workers
+        self.depth = depth
+        self.chunk_size = chunk_size
+        self.timings = timings or StageTimings()
+
+    @property
+    def model_id(self) -> str:
+        return self.model.model_id
+
+    def _prepare(self, chunk: np.ndarray, texts: List[str], max_tokens: int, batch_size: int) -> Tuple[List[Tuple[np.ndarray, Any]], Dict[str, Any]]:
+        "Tokenize one chunk and pad its batches: ([(text indices, padded inputs)], padding_stats)"
+        start = time.perf_counter()
+        enc = self.model.tokenize([texts[i] for i in chunk])
+        lengths = [len(ids) for ids in enc["input_ids"]]
+        batches = plan_batches(lengths, max_tokens, batch_size)
+        prepared = [(chunk[batch], self.model.pad({key: [enc[key][i] for i in batch] for key in enc.keys()})) for batch in batches]
+        self.timings.add("tokenize", time.perf_counter() - start, len(chunk))
+        return prepared, padding_stats(lengths, batches)
+
+    def scores(self, texts: List[str], max_tokens: int = DEFAULT_MAX_TOKENS, batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> Tuple[List[float], Dict[str, Any]]:
+        "Scores in [-1, 1] in the order of texts, and the padding stats summed over the chunks"
+        self.model.load() # before the workers: settles the tokenizer state they share
+        scores = np.zeros(len(texts))
+        chunks = [np.arange(start, min(start + self.chunk_size, len(texts))) for start in range(0, len(texts), self.chunk_size)]
+        stats = [padding_stats([], [])]
+        prepare = lambda chunk: self._prepare(chunk, texts, max_tokens, batch_size)
+        for _, (prepared, chunk_stats) in pipelined(chunks, prepare, self.workers, self.depth, self.timings):
+            start = time.perf_counter()
+            for indices, padded in prepared:
+                scores[indices] = probs_to_scores(_softmax(self.model.forward(padded)))
+            self.timings.add("infer", time.perf_counter() - start, sum(len(indices) for indices, _ in prepared))
+            stats.append(chunk_stats)
+        return scores.tolist(), merge_padding_stats(stats)
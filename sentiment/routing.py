@@ -0,0 +1,56 @@
+import threading
+from typing import Optional, Dict, Any, Sequence
+
+import numpy as np
+
+SUPPORTED_LANGUAGES = ("en",) # what the main model was trained on
+NON_LINGUISTIC_LANGUAGES = ("zxx", "und") # no text at all / nothing Twitter could identify
+MULTILINGUAL_MODEL_PATH = "cardiffnlp/twitter-xlm-roberta-base-sentiment" # same negative/neutral/positive labels
+ROUTES = ("main", "multilingual", "drop")
+
+def is_non_linguistic(lang: str) -> bool:
+    "zxx, und and Twitter's private q* codes: qme media only, qam mentions only, qht hashtags only, qct cashtags only, qst too short"
+    return lang in NON_LINGUISTIC_LANGUAGES or (len(lang) == 3 and lang.startswith("q"))
+
+def route_languages(langs: Sequence[str], supported: Sequence[str] = SUPPORTED_LANGUAGES, multilingual: bool = False) -> np.ndarray:
+    """
+    The route of every comment from its lang field, one of ROUTES:
+        main: a supported language, or no lang recorded
+        multilingual: any other language when there is a multilingual model, dropped otherwise
+        drop: non-linguistic, never scored
+    """
+    routes = np.empty(len(langs), dtype=object)
+    for i, lang in enumerate(langs):
+        if not lang or lang in supported:
+            routes[i] = "main"
+        elif is_non_linguistic(lang):
+            routes[i] = "drop"
+        else:
+            routes[i] = "multilingual" if multilingual else "drop"
+    return routes
+
+class LanguageStats:
+    "Running per-language comment counts and the time spent on every route"
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.languages: Dict[str, Dict[str, int]] = {} # lang -> {route: comments}
+        self.routes = {route: {"comments": 0, "seconds": 0.0} for route in ROUTES}
+
+    def add(self, langs: Sequence[str], routes: Sequence[str]):
+        with self._lock:
+            for lang, route in zip(langs, routes):
+                counts = self.languages.setdefault(lang or "unknown", {})
+                counts[route] = counts.get(route, 0) + 1
+                self.routes[route]["comments"] += 1
+
+    def add_time(self, route: str, seconds: float):
+        with self._lock:
+            self.routes[route]["seconds"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            languages = sorted(self.languages.items(), key=lambda item: -sum(item[1].values()))
+            return {
+                "languages": {lang: dict(counts) for lang, counts in languages},
+                "routes": {route: dict(values) for route, values in self.routes.items()},
+            }
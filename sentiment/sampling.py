@@ -0,0 +1,30 @@
+from statistics import NormalDist
+from typing import Tuple
+
+import numpy as np
+
+DEFAULT_SAMPLING = {
+    "target_width": 0.1, # stop paging a tweet once its confidence interval is narrower than this (scores are in [0, 1])
+    "confidence": 0.95,
+    "min_comments": 20, # never trust an interval from fewer comments
+    "max_pages": 10, # TweetDetail requests per tweet
+}
+
+def weighted_mean_interval(scores: np.ndarray, weights: np.ndarray, confidence: float = DEFAULT_SAMPLING["confidence"]) -> Tuple[float, float, float]:
+    """
+    (mean, low, high) of the weighted mean of scores, with a normal approximation interval that uses
+    Kish's effective sample size (sum w)^2 / sum w^2, so a few heavily liked comments count as few samples.
+    The interval is infinite below 2 effective samples, the mean nan without any.
+    """
+    scores = np.asarray(scores, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    total = weights.sum()
+    if not len(scores) or total <= 0:
+        return float("nan"), float("-inf"), float("inf")
+    mean = float(np.dot(weights, scores) / total)
+    n_eff = total ** 2 / np.dot(weights, weights)
+    if n_eff < 2:
+        return mean, float("-inf"), float("inf")
+    variance = np.dot(weights, (scores - mean) ** 2) / total * n_eff / (n_eff - 1)
+    half_width = NormalDist().inv_cdf(0.5 + confidence / 2) * float(np.sqrt(variance / n_eff))
+    return mean, mean - half_width, mean + half_width
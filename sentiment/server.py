@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from .backends import SentimentModel, MODEL_PATH, BACKENDS
+
+# a Unix socket where there are Unix sockets, localhost elsewhere
+DEFAULT_ADDRESS = os.environ.get(
+    "SENTIMENT_SERVER_ADDRESS",
+    str(Path(__file__).parent / ".cache" / "inference.sock") if hasattr(socket, "AF_UNIX") else "127.0.0.1:8765",
+)
+DEFAULT_MAX_BATCH_TEXTS = 256
+DEFAULT_FLUSH_MS = 5.0
+AVAILABILITY_TTL = 10.0 # seconds an available() answer is reused, so scoring calls do not each pay an info round trip
+_HEADER = struct.Struct(">I") # every message is a 4 byte length followed by that many bytes of json
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    "('tcp', (host, port)) for host:port, otherwise ('unix', path)"
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address and '\\' not in address:
+        return "tcp", (host, int(port))
+    return "unix", address
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message).encode()
+    return _HEADER.pack(len(body)) + body
+
+async def _read_message(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    try:
+        (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+        return json.loads(await reader.readexactly(size))
+    except asyncio.IncompleteReadError:
+        return None # client went away
+
+class MicroBatcher:
+    """
+    Collects scoring requests from all connections into one model call: a batch is flushed once it holds
+    max_batch_texts texts or flush_ms after its first request arrived. Requests that arrive while the model
+    is busy are batched together for the next call.
+    """
+    def __init__(self, model: SentimentModel, max_batch_texts: int = DEFAULT_MAX_BATCH_TEXTS, flush_ms: float = DEFAULT_FLUSH_MS):
+        self.model = model
+        self.max_batch_texts = max_batch_texts
+        self.flush_ms = flush_ms
+        self.queue: "asyncio.Queue[Tuple[List[str], asyncio.Future]]" = asyncio.Queue()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+
+    async def submit(self, texts: List[str]) -> Tuple[List[float], Dict[str, Any]]:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            count = len(pending[0][0])
+            deadline = loop.time() + self.flush_ms / 1000
+            while count < self.max_batch_texts and (timeout := deadline - loop.time()) > 0:
+                try:
+                    pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                count += len(pending[-1][0])
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            try:
+                scores, stats = await loop.run_in_executor(None, self.model.scores, texts)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done(): future.set_exception(e)
+                continue
+            self.batches += 1
+            self.requests += len(pending)
+            self.texts += len(texts)
+            offset = 0
+            for request_texts, future in pending:
+                if not future.done(): future.set_result((scores[offset : offset + len(request_texts)], stats))
+                offset += len(request_texts)
+
+    def info(self) -> Dict[str, Any]:
+        return {"model_id": self.model.model_id, "batches": self.batches, "requests": self.requests, "texts": self.texts}
+
+async def aserve(model: SentimentModel, address: str = DEFAULT_ADDRESS, max_batch_texts: int = DEFAULT_MAX_BATCH_TEXTS, flush_ms: float = DEFAULT_FLUSH_MS):
+    "Keep the model warm and answer scoring requests until cancelled"
+    model.load()
+    batcher = MicroBatcher(model, max_batch_texts, flush_ms)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while (request := await _read_message(reader)) is not None:
+                try:
+                    if request.get("op") == "info":
+                        reply = batcher.info()
+                    else:
+                        scores, stats = await batcher.submit(request["texts"])
+                        reply = {"scores": scores, "stats": stats}
+                except Exception as e:
+                    reply = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(_encode(reply))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    kind, where = parse_address(address)
+    if kind == "unix":
+        Path(where).parent.mkdir(parents=True, exist_ok=True)
+        Path(where).unlink(missing_ok=True) # left over from a server that did not shut down cleanly
+        server = await asyncio.start_unix_server(handle, path=where)
+    else:
+        server = await asyncio.start_server(handle, *where)
+    print(f"Serving {model.model_id} on {address}")
+    async with server:
+        await asyncio.gather(server.serve_forever(), batcher.run())
+
+def serve(model: SentimentModel, address: str = DEFAULT_ADDRESS, max_batch_texts: int = DEFAULT_MAX_BATCH_TEXTS, flush_ms: float = DEFAULT_FLUSH_MS):
+    asyncio.run(aserve(model, address, max_batch_texts, flush_ms))
+
+class InferenceClient:
+    """
+    Blocking client for the inference server, with the same scores() as SentimentModel so it can stand in for it.
+    Every thread gets its own connection so concurrent callers end up in the same micro-batch.
+    The batch plan is the server's, max_tokens/batch_size are accepted for compatibility only.
+    """
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: float = 120.0, availability_ttl: float = AVAILABILITY_TTL):
+        self.address = address
+        self.timeout = timeout
+        self.availability_ttl = availability_ttl
+        self._local = threading.local()
+        self._model_id: Optional[str] = None
+        self._available: Optional[bool] = None
+        self._checked_at = 0.0
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            kind, where = parse_address(self.address)
+            if kind == "unix":
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                try:
+                    sock.connect(where)
+                except OSError:
+                    sock.close()
+                    raise
+            else:
+                sock = socket.create_connection(where, timeout=self.timeout)
+            self._local.sock = sock
+        return sock
+
+    def _recv_exactly(self, sock: socket.socket, size: int) -> bytes:
+        chunks = []
+        while size:
+            chunk = sock.recv(size)
+            if not chunk:
+                raise ConnectionError("Inference server closed the connection")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def _call(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            sock = self._connection()
+            sock.sendall(_encode(request))
+            (size,) = _HEADER.unpack(self._recv_exactly(sock, _HEADER.size))
+            reply = json.loads(self._recv_exactly(sock, size))
+        except OSError as e:
+            self.close()
+            self._available, self._checked_at = False, time.monotonic() # callers go local until the next check
+            raise ConnectionError(f"Inference server at {self.address} unreachable: {e}") from e
+        if "error" in reply:
+            raise Exception(f"Inference server: {reply['error']}")
+        return reply
+
+    def info(self) -> Dict[str, Any]:
+        return self._call({"op": "info"})
+
+    @property
+    def model_id(self) -> str:
+        if self._model_id is None:
+            self._model_id = self.info()["model_id"]
+        return self._model_id
+
+    def available(self) -> bool:
+        "Whether a server is listening, asked at most every availability_ttl seconds and never waiting on a missing socket"
+        now = time.monotonic()
+        if self._available is not None and now - self._checked_at < self.availability_ttl:
+            return self._available
+        kind, where = parse_address(self.address)
+        if kind == "unix" and not os.path.exists(where):
+            available = False
+        else:
+            try:
+                self._model_id = self.info()["model_id"]
+                available = True
+            except Exception:
+                available = False
+        self._available, self._checked_at = available, time.monotonic()
+        return available
+
+    def scores(self, texts: List[str], max_tokens: Optional[int] = None, batch_size: Optional[int] = None) -> Tuple[List[float], Dict[str, Any]]:
+        "Scores in [-1, 1] in the order of texts, and the padding stats of the micro-batch they ran in"
+        reply = self._call({"texts": list(texts)})
+        return reply["scores"], reply["stats"]
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local sentiment inference server with request micro-batching")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="Unix socket path or host:port")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--backend", default=os.environ.get("SENTIMENT_BACKEND", "torch"), choices=BACKENDS)
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH_TEXTS, help="flush a micro-batch at this many texts")
+    parser.add_argument("--flush-ms", type=float, default=DEFAULT_FLUSH_MS, help="flush a micro-batch this long after its first request")
+    args = parser.parse_args()
+    serve(SentimentModel(args.model, args.backend, num_threads=args.threads), args.address, args.max_batch, args.flush_ms)
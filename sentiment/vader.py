@@ -0,0 +1,230 @@
+import operator
+import re
+import string
+import sys
+from itertools import repeat
+from typing import Optional, Dict, Any, List, Sequence
+
+import numpy as np
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer, BOOSTER_DICT, NEGATE, SPECIAL_CASES, C_INCR, N_SCALAR
+
+# words the rules look for around a lexicon word
+_MARKERS = ("no", "or", "nor", "kind", "of", "least", "at", "very", "never", "so", "this", "without", "doubt", "but")
+# the n-gram idioms and the "but" rescaling are left to the reference implementation, they are rare in replies
+_RARE_PHRASES = re.compile("|".join(re.escape(phrase) for phrase in (*SPECIAL_CASES, *BOOSTER_DICT) if " " in phrase))
+
+def _segment_sums(values: np.ndarray, segment: np.ndarray, pos: np.ndarray, count: int) -> np.ndarray:
+    "Per-segment sums of values, added in order the way the builtin sum() adds the reference's list"
+    if sys.version_info < (3, 12):
+        return np.bincount(segment, weights=values, minlength=count)
+    # sum() of floats is Neumaier-compensated since 3.12: near-zero sums can differ in sign from a plain sum,
+    # which decides the punctuation amplifier. Run it column by column over the texts as rows, zero padding adds nothing
+    matrix = np.zeros((count, int(pos.max()) + 1 if len(pos) else 0))
+    matrix[segment, pos] = values
+    total = np.zeros(count)
+    compensation = np.zeros(count)
+    for x in matrix.T:
+        t = total + x
+        compensation += np.where(np.abs(total) >= np.abs(x), (total - t) + x, (x - t) + total)
+        total = t
+    return total + compensation
+
+class BatchVader:
+    """
+    vaderSentiment's polarity_scores over a whole list of texts.
+    Texts are tokenized once into a flat token stream, lexicon valences come from arrays indexed by a
+    precomputed word index, and the booster/negation/capitalization/"least" rules are applied with NumPy
+    over the whole stream using shifted views for the 1-3 preceding words. Per-text sums are bincounts.
+    Texts that hit the rare n-gram idioms or contain "but" are scored by the reference analyzer.
+    Scores match vaderSentiment, see check_parity.
+    """
+    def __init__(self, analyzer: Optional[SentimentIntensityAnalyzer] = None):
+        self.analyzer = analyzer or SentimentIntensityAnalyzer()
+        words = list(dict.fromkeys([*self.analyzer.lexicon, *BOOSTER_DICT, *NEGATE, *_MARKERS]))
+        self.index = {word: i for i, word in enumerate(words)}
+        self.unknown = len(words) # row for every word outside the index
+        self.valence = np.zeros(len(words) + 1)
+        self.in_lexicon = np.zeros(len(words) + 1, dtype=bool)
+        self.booster = np.zeros(len(words) + 1)
+        self.is_booster = np.zeros(len(words) + 1, dtype=bool)
+        self.negation = np.zeros(len(words) + 1, dtype=bool)
+        for word, valence in self.analyzer.lexicon.items():
+            self.valence[self.index[word]] = valence
+            self.in_lexicon[self.index[word]] = True
+        for word, scalar in BOOSTER_DICT.items():
+            self.booster[self.index[word]] = scalar
+            self.is_booster[self.index[word]] = True
+        self.negation[[self.index[word] for word in NEGATE]] = True
+        self.marker = {word: self.index[word] for word in _MARKERS}
+        # polarity_scores replaces emojis one character at a time, so only single character entries can match
+        self.emojis = {emoji: description for emoji, description in self.analyzer.emojis.items() if len(emoji) == 1}
+        self._emoji_re = re.compile("[" + "".join(re.escape(emoji) for emoji in self.emojis) + "]")
+
+    def _replace_emojis(self, text: str) -> str:
+        if text.isascii():
+            return text
+        def describe(match: re.Match) -> str:
+            start = match.start()
+            # a description is separated from what precedes it unless that is a space, and glued to what follows
+            return ("" if start == 0 or text[start - 1] == " " else " ") + self.emojis[match.group()]
+        return self._emoji_re.sub(describe, text)
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        # SentiText._words_and_emoticons: strip punctuation unless that leaves 2 characters or less (emoticons)
+        return [word if len(stripped := word.strip(string.punctuation)) <= 2 else stripped for word in text.split()]
+
+    @staticmethod
+    def _needs_reference(lower: List[str]) -> bool:
+        return "but" in lower or _RARE_PHRASES.search(" ".join(lower)) is not None
+
+    def scores(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        "{'neg', 'neu', 'pos', 'compound'} arrays, one value per text"
+        n = len(texts)
+        result = {key: np.zeros(n) for key in ("neg", "neu", "pos", "compound")}
+        prepared = [self._replace_emojis(text).strip() for text in texts]
+
+        tokens, lowered, batch, lengths, fallback = [], [], [], [], []
+        for k, text in enumerate(prepared):
+            words = self._tokens(text)
+            lower = " ".join(words).lower().split(" ") if words else []
+            if self._needs_reference(lower):
+                fallback.append(k)
+                continue
+            batch.append(k)
+            lengths.append(len(words))
+            tokens.extend(words)
+            lowered.extend(lower)
+
+        if tokens:
+            self._score_stream(tokens, lowered, np.asarray(lengths), [prepared[k] for k in batch], result, np.asarray(batch))
+        for k in fallback:
+            for key, value in self.analyzer.polarity_scores(texts[k]).items():
+                result[key][k] = value
+        return result
+
+    def _score_stream(self, tokens: List[str], lowered: List[str], lengths: np.ndarray, texts: List[str], result: Dict[str, np.ndarray], rows: np.ndarray):
+        total = len(tokens)
+        m = self.marker
+        ids = np.fromiter(map(self.index.get, lowered, repeat(self.unknown)), dtype=np.int64, count=total)
+        upper = np.fromiter(map(str.isupper, tokens), dtype=bool, count=total)
+        negated = self.negation[ids] | np.fromiter(map(operator.contains, lowered, repeat("n't")), dtype=bool, count=total)
+        text_of = np.repeat(np.arange(len(lengths)), lengths)
+        pos = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths) # position within its text
+        last = pos == np.repeat(lengths, lengths) - 1
+        upper_count = np.bincount(text_of, weights=upper, minlength=len(lengths))
+        cap_diff = ((upper_count > 0) & (upper_count < lengths))[text_of] # some but not all words in caps
+
+        def shifted(values: np.ndarray, k: int, fill) -> np.ndarray:
+            # values of the k-th preceding (k > 0) or following (k < 0) word of the same text, fill where there is none
+            out = np.full_like(values, fill)
+            if k > 0:
+                out[k:] = values[:-k]
+                out[pos < k] = fill
+            else:
+                out[:k] = values[-k:]
+                out[pos >= np.repeat(lengths, lengths) + k] = fill
+            return out
+
+        prev_ids = {k: shifted(ids, k, self.unknown) for k in (1, 2, 3)}
+        prev_upper = {k: shifted(upper, k, False) for k in (1, 2, 3)}
+        prev_negated = {k: shifted(negated, k, False) for k in (1, 2, 3)}
+        next_ids = shifted(ids, -1, self.unknown)
+        p1, p2, p3 = prev_ids[1], prev_ids[2], prev_ids[3]
+
+        # lexicon words that are scored: boosters and the "kind" of "kind of" count as 0
+        kind_of = (ids == m["kind"]) & (next_ids == m["of"]) & ~last
+        scored = self.in_lexicon[ids] & ~self.is_booster[ids] & ~kind_of
+
+        v = np.where(scored, self.valence[ids], 0.0)
+        # "no" before another lexicon word negates that word instead of counting itself
+        v = np.where(scored & (ids == m["no"]) & ~last & self.in_lexicon[next_ids], 0.0, v)
+        after_no = (p1 == m["no"]) | (p2 == m["no"]) | ((p3 == m["no"]) & ((p1 == m["or"]) | (p1 == m["nor"])))
+        v = np.where(scored & after_no, self.valence[ids] * N_SCALAR, v)
+        v = np.where(scored & upper & cap_diff, np.where(v > 0, v + C_INCR, v - C_INCR), v)
+
+        so_or_this = lambda ids: (ids == m["so"]) | (ids == m["this"])
+        for start_i, damp in ((0, 1.0), (1, 0.95), (2, 0.9)):
+            k = start_i + 1
+            previous = prev_ids[k]
+            applies = scored & (pos > start_i) & ~self.in_lexicon[previous]
+            # scalar_inc_dec: boosters push away from zero, more so in caps
+            scalar = np.where(v < 0, -self.booster[previous], self.booster[previous])
+            scalar = np.where(self.is_booster[previous] & prev_upper[k] & cap_diff, np.where(v > 0, scalar + C_INCR, scalar - C_INCR), scalar)
+            if damp != 1.0:
+                scalar = np.where(scalar != 0, scalar * damp, scalar)
+            v = np.where(applies, v + scalar, v)
+            # _negation_check
+            if start_i == 0:
+                v = np.where(applies & prev_negated[1], v * N_SCALAR, v)
+            elif start_i == 1:
+                amplify = (p2 == m["never"]) & so_or_this(p1)
+                keep = (p2 == m["without"]) & (p1 == m["doubt"])
+                v = np.where(applies & amplify, v * 1.25, np.where(applies & ~keep & prev_negated[2], v * N_SCALAR, v))
+            else:
+                amplify = ((p3 == m["never"]) & so_or_this(p2)) | so_or_this(p1)
+                keep = (p3 == m["without"]) & ((p2 == m["doubt"]) | (p1 == m["doubt"]))
+                v = np.where(applies & amplify, v * 1.25, np.where(applies & ~amplify & ~keep & prev_negated[3], v * N_SCALAR, v))
+
+        # _least_check ("least" is not in the lexicon)
+        after_least = scored & (p1 == m["least"]) & ((pos == 1) | ~((p2 == m["at"]) | (p2 == m["very"])))
+        v = np.where(after_least, v * N_SCALAR, v)
+
+        # score_valence
+        count = len(lengths)
+        sum_s = _segment_sums(v, text_of, pos, count)
+        pos_sum = np.bincount(text_of, weights=np.where(v > 0, v + 1, 0.0), minlength=count)
+        neg_sum = np.bincount(text_of, weights=np.where(v < 0, v - 1, 0.0), minlength=count)
+        neu_count = np.bincount(text_of, weights=v == 0, minlength=count)
+        exclamations = np.minimum([text.count("!") for text in texts], 4) * 0.292
+        questions = np.array([text.count("?") for text in texts])
+        amplifier = exclamations + np.where(questions > 3, 0.96, np.where(questions > 1, questions * 0.18, 0.0))
+
+        sum_s = np.where(sum_s > 0, sum_s + amplifier, np.where(sum_s < 0, sum_s - amplifier, sum_s))
+        compound = np.clip(sum_s / np.sqrt(sum_s * sum_s + 15), -1.0, 1.0)
+        pos_sum, neg_sum = (
+            np.where(pos_sum > np.abs(neg_sum), pos_sum + amplifier, pos_sum),
+            np.where(pos_sum < np.abs(neg_sum), neg_sum - amplifier, neg_sum),
+        )
+        denominator = pos_sum + np.abs(neg_sum) + neu_count
+        has_tokens = lengths > 0
+        denominator = np.where(has_tokens, denominator, 1.0)
+        # python's round to match the reference digit for digit
+        for key, values, digits in (
+            ("neg", np.abs(neg_sum / denominator), 3),
+            ("neu", np.abs(neu_count / denominator), 3),
+            ("pos", np.abs(pos_sum / denominator), 3),
+            ("compound", compound, 4),
+        ):
+            result[key][rows] = [round(float(value), digits) if ok else 0.0 for value, ok in zip(values, has_tokens)]
+
+    def polarity_scores(self, texts: Sequence[str]) -> List[Dict[str, float]]:
+        "The reference's polarity_scores dict for each text"
+        scores = self.scores(texts)
+        return [{key: float(scores[key][i]) for key in ("neg", "neu", "pos", "compound")} for i in range(len(texts))]
+
+    def compound(self, texts: Sequence[str]) -> np.ndarray:
+        return self.scores(texts)["compound"]
+
+def check_parity(texts: Sequence[str], vader: Optional[BatchVader] = None, tolerance: float = 1e-9) -> Dict[str, Any]:
+    """
+    Compare BatchVader against vaderSentiment's polarity_scores on texts (e.g. scraped comments):
+    the largest difference per field, the texts that differ by more than tolerance, and how many texts
+    went to the reference fallback.
+    """
+    vader = vader or BatchVader()
+    batch = vader.scores(texts)
+    reference = [vader.analyzer.polarity_scores(text) for text in texts]
+    max_diff = {}
+    mismatches = set()
+    for key in ("neg", "neu", "pos", "compound"):
+        diff = np.abs(batch[key] - np.array([r[key] for r in reference]))
+        max_diff[key] = float(diff.max()) if len(diff) else 0.0
+        mismatches.update(np.flatnonzero(diff > tolerance).tolist())
+    fallback = sum(vader._needs_reference([word.lower() for word in vader._tokens(vader._replace_emojis(text).strip())]) for text in texts)
+    return {
+        "texts": len(texts),
+        "max_abs_diff": max_diff,
+        "mismatches": [texts[i] for i in sorted(mismatches)],
+        "fallback_fraction": fallback / len(texts) if len(texts) else 0.0,
+    }
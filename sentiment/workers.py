@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+import torch
+
+from .backends import SentimentModel, MODEL_PATH
+from .batching import merge_padding_stats, DEFAULT_MAX_TOKENS, DEFAULT_MAX_BATCH_SIZE
+
+_parent_model: Optional[SentimentModel] = None # loaded before forking, inherited by the workers
+_worker_model: Optional[SentimentModel] = None
+
+def _init_worker(model_path: str, backend: str, threads: int):
+    global _worker_model
+    torch.set_num_threads(threads)
+    if _parent_model is not None and (_parent_model.model_path, _parent_model.backend) == (model_path, backend):
+        _worker_model = _parent_model
+        _worker_model.num_threads = threads
+    else:
+        _worker_model = SentimentModel(model_path, backend, device="cpu", num_threads=threads).load()
+
+def _score_shard(texts: List[str], max_tokens: int, batch_size: int) -> Tuple[List[float], Dict[str, Any]]:
+    return _worker_model.scores(texts, max_tokens, batch_size)
+
+class InferencePool:
+    """
+    N CPU replicas of the sentiment model in worker processes, each capped at threads_per_worker intra-op threads
+    so the replicas do not fight over cores. Texts are sharded over the replicas by length and merged back in order.
+    Where processes are forked, the torch model is loaded once in the parent and the replicas share its weight
+    pages copy-on-write; elsewhere (and for the onnx backend, whose sessions do not survive a fork) each worker
+    loads its own copy.
+    """
+    def __init__(self, workers: int, threads_per_worker: Optional[int] = None, model_path: str = MODEL_PATH, backend: str = "torch"):
+        self.workers = max(1, int(workers))
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.model_path = model_path
+        self.backend = backend
+        self.model_id = SentimentModel(model_path, backend, device="cpu").model_id
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> ProcessPoolExecutor:
+        global _parent_model
+        with self._lock:
+            if self._executor is None:
+                fork = "fork" in multiprocessing.get_all_start_methods()
+                if fork and self.backend != "onnx":
+                    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false") # forked tokenizers would otherwise warn and serialise
+                    _parent_model = SentimentModel(self.model_path, self.backend, device="cpu").load()
+                context = multiprocessing.get_context("fork" if fork else "spawn")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self.model_path, self.backend, self.threads_per_worker),
+                )
+            return self._executor
+
+    def scores(self, texts: List[str], max_tokens: int = DEFAULT_MAX_TOKENS, batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> Tuple[List[float], Dict[str, Any]]:
+        "Scores in [-1, 1] in the order of texts, and the padding stats summed over the shards"
+        executor = self._start()
+        # deal texts out by length so every replica gets a similar mix of short and long texts
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        shards = [np.sort(shard) for shard in (order[i::self.workers] for i in range(self.workers)) if len(shard)]
+        futures = [executor.submit(_score_shard, [texts[i] for i in shard], max_tokens, batch_size) for shard in shards]
+        scores = np.zeros(len(texts))
+        stats = []
+        for shard, future in zip(shards, futures):
+            shard_scores, shard_stats = future.result()
+            scores[shard] = shard_scores
+            stats.append(shard_stats)
+        return scores.tolist(), merge_padding_stats(stats)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -1,56 +1,91 @@
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from typing import List
+from typing import List, Dict, Tuple, Any, Callable, Iterable
+import os
+import time
 import numpy as np
-from twitter.utils import stringify_tweet
+from twitter.utils import stringify_tweet, TweetBatch
+from sentiment.batching import padding_stats, DEFAULT_MAX_TOKENS, DEFAULT_MAX_BATCH_SIZE
+from sentiment.backends import SentimentModel, probs_to_scores
+from sentiment.cache import ScoreCache
+from sentiment.workers import InferencePool
+from sentiment.server import InferenceClient
+from sentiment.cascade import transformer_mask, CascadeStats
+from sentiment.vader import BatchVader
+from sentiment.pipeline import PipelinedModel, StageTimings, DEFAULT_PIPELINE_WORKERS
+from sentiment.routing import route_languages, LanguageStats
+from sentiment.dedup import collapse_near_duplicates
+from sentiment.sampling import weighted_mean_interval, DEFAULT_SAMPLING
 
 analyzer = SentimentIntensityAnalyzer()
+batch_vader = BatchVader(analyzer) # same scores as analyzer.polarity_scores, a whole list at a time
 roberta_model_path = "cardiffnlp/twitter-roberta-base-sentiment-latest"
 # sentiment_task = pipeline("sentiment-analysis", model=roberta_model_path, tokenizer=roberta_model_path)
-tokenizer = AutoTokenizer.from_pretrained(roberta_model_path, use_fast=True)
-model = AutoModelForSequenceClassification.from_pretrained(roberta_model_path)
-model.to('cuda' if torch.cuda.is_available() else 'cpu')
-model.eval()
-
-def calculate_roberta_sentiment_scores(texts: List[str], batch_size: int = 32) -> List[float]:
-    """
-    Batch inference returning continuous scores in [-1, 1]:
-    score = prob_pos - prob_neg
-    For models with 3 labels arranged [negative, neutral, positive].
-    """
-    scores = []
-    with torch.no_grad():
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
-            enc = tokenizer(batch, return_tensors="pt", padding=True, truncation=True, max_length=256)
-            enc = {k: v.to('cuda') for k, v in enc.items()}
-            out = model(**enc)
-            logits = out.logits.cpu()
-            probs = torch.softmax(logits, dim=-1).numpy()  # shape (batch, num_labels)
-            # mapping - assumes label order is neg, neu, pos
-            # if model uses different label order, you must reorder accordingly
-            for p in probs:
-                if p.shape[0] == 3:
-                    prob_neg, prob_neu, prob_pos = p
-                    score = float(prob_pos - prob_neg)  # in (-1, 1)
-                elif p.shape[0] == 2:
-                    # binary model mapping (pos prob - neg prob)
-                    prob_neg = p[0]
-                    prob_pos = p[1]
-                    score = float(prob_pos - prob_neg)
-                else:
-                    # fallback: compute (expected label index scaled)
-                    labels = np.arange(len(p))
-                    norm = (labels - labels.mean()) / (labels.max() - labels.min() + 1e-9)
-                    score = float(np.dot(p, norm))
-                    # then scale to -1..1
-                    score = max(-1.0, min(1.0, score))
-                scores.append(score)
+# loaded on the first call; SENTIMENT_BACKEND is "torch" (fp32) | "torch-int8" | "onnx", see sentiment.compare_backends before switching
+roberta = SentimentModel(
+    roberta_model_path,
+    backend=os.environ.get("SENTIMENT_BACKEND", "torch"),
+    num_threads=int(os.environ["SENTIMENT_THREADS"]) if os.environ.get("SENTIMENT_THREADS") else None,
+)
+# tokenization runs on SENTIMENT_PIPELINE_WORKERS threads overlapped with the forward passes, 0 runs them one after the other
+pipeline_workers = int(os.environ.get("SENTIMENT_PIPELINE_WORKERS", DEFAULT_PIPELINE_WORKERS))
+stage_timings = StageTimings() # clean/tokenize/infer seconds of this run, plus starved/blocked queue waits
+local_roberta = PipelinedModel(roberta, pipeline_workers, timings=stage_timings) if pipeline_workers > 0 else roberta
+# comments in languages the main model does not know go to SENTIMENT_MULTILINGUAL_MODEL (e.g. sentiment.MULTILINGUAL_MODEL_PATH)
+# in a batch of their own, they are dropped when it is not set
+multilingual_model_path = os.environ.get("SENTIMENT_MULTILINGUAL_MODEL")
+multilingual = SentimentModel(multilingual_model_path, backend=roberta.backend, num_threads=roberta.num_threads) if multilingual_model_path else None
+if multilingual is not None and pipeline_workers > 0:
+    multilingual = PipelinedModel(multilingual, pipeline_workers, timings=stage_timings)
+language_stats = LanguageStats() # comments per language and time per route of this run
+dedup_comments = os.environ.get("SENTIMENT_DEDUP", "on") != "off" # score near-duplicate replies once, see score_texts
+score_cache = ScoreCache() # scores by model id + cleaned text, in memory and in sentiment/.cache/scores.db
+inference_pools = {} # workers -> InferencePool, started on first use and kept for the process lifetime
+
+cascade_stats = CascadeStats() # how much of this run the cascade kept away from RoBERTa
+server_client = InferenceClient() # python -m sentiment.server keeps a warm model shared by all runs; SENTIMENT_SERVER=off to ignore it
+
+def get_inference_pool(workers: int) -> InferencePool:
+    pool = inference_pools.get(workers)
+    if pool is None:
+        pool = inference_pools[workers] = InferencePool(workers, model_path=roberta.model_path, backend=roberta.backend)
+    return pool
+
+def get_scorer(workers: int = 1):
+    "Where RoBERTa runs: a local process pool when asked for, else the inference server when one is up, else in process"
+    if workers > 1:
+        return get_inference_pool(workers)
+    if os.environ.get("SENTIMENT_SERVER", "auto") != "off" and server_client.available():
+        return server_client
+    return local_roberta
+
+def calculate_roberta_sentiment_scores(texts: List[str], max_tokens: int = DEFAULT_MAX_TOKENS, batch_size: int = DEFAULT_MAX_BATCH_SIZE, return_stats: bool = False, use_cache: bool = True, workers: int = 1, model=None):
+    """
+    Batch inference returning continuous scores in [-1, 1], in the order of texts.
+    Texts found in score_cache are not run through the model again.
+    workers > 1 shards the texts over that many CPU model replicas in worker processes,
+    otherwise the inference server is used when it is running (see get_scorer).
+    model overrides that choice, e.g. with the multilingual model.
+    With return_stats, also return the padding_stats of the texts that were run.
+    """
+    stats = padding_stats([], [])
+    model = model or get_scorer(workers)
+    def compute(texts: List[str]) -> List[float]:
+        nonlocal stats
+        try:
+            scores, stats = model.scores(texts, max_tokens, batch_size)
+        except ConnectionError as e:
+            if model is not server_client: raise
+            print(f"{e}, scoring locally")
+            scores, stats = local_roberta.scores(texts, max_tokens, batch_size)
+        return scores
+    scores = score_cache.get_or_compute(model.model_id, texts, compute) if use_cache else compute(list(texts))
+    if return_stats:
+        return scores, stats
     return scores
 
-def calculate_vader_sentiment_scores(texts: List[str]) -> List[float]:
-    return [analyzer.polarity_scores(sentence)["compound"] for sentence in texts]
+def calculate_vader_sentiment_scores(texts: List[str], use_cache: bool = True) -> List[float]:
+    compute = lambda texts: batch_vader.compound(texts).tolist()
+    return score_cache.get_or_compute("vader", texts, compute) if use_cache else compute(texts)
 
 def combine_scores(roberta_scores, vader_scores, roberta_weight=0.7, vader_weight=0.3):
     """
@@ -81,24 +116,225 @@ def combine_scores(roberta_scores, vader_scores, roberta_weight=0.7, vader_weigh
     combined = np.clip(combined, -1.0, 1.0)
     return combined
 
-def calculate_overall_sentiment(comments, roberta_weight=0.8, vader_weight=0.2):
+def clean_comments(comments):
     """
-    Calculate the overall sentiment of the comments.
-    Return the overall sentiment score in [0, 1].
+    Indices of the comments that have something to score, their cleaned text and their route by language
+    (see sentiment.routing.route_languages). Non-linguistic comments are dropped here, before any inference.
     """
-    cleaned_comments = []
+    start = time.perf_counter()
+    langs = [comment.get("lang") or "" for comment in comments]
+    routes = route_languages(langs, multilingual=multilingual is not None)
+    language_stats.add(langs, routes)
+    kept = []
     cleaned_comments_str = []
-    for comment in comments:
+    for i, comment in enumerate(comments):
+        if routes[i] == "drop": continue
         cleaned_comment = stringify_tweet(comment)
         if not cleaned_comment: continue
-        cleaned_comments.append(comment)
+        kept.append(i)
         cleaned_comments_str.append(cleaned_comment)
+    stage_timings.add("clean", time.perf_counter() - start, len(comments))
+    kept = np.asarray(kept, dtype=np.int64)
+    return kept, cleaned_comments_str, routes[kept]
+
+def score_comments(comments, roberta_weight=0.8, vader_weight=0.2, workers=1, cascade=False, gates=None):
+    """
+    Clean and score comments, RoBERTa running on `workers` processes.
+    With cascade, VADER scores everything first and only the comments it is unsure about
+    (near-neutral, mixed, few known words or likely sarcastic, see sentiment.cascade.DEFAULT_GATES)
+    go through RoBERTa; the rest keep their VADER score.
+    Return the comments that had something to score and their combined scores in [0, 1].
+    """
+    kept, cleaned_comments_str, routes = clean_comments(comments)
+    cleaned_comments = [comments[i] for i in kept]
+    return cleaned_comments, score_texts(cleaned_comments_str, roberta_weight, vader_weight, workers, cascade, gates, routes)
+
+def score_texts(cleaned_comments_str, roberta_weight=0.8, vader_weight=0.2, workers=1, cascade=False, gates=None, routes=None, dedup=None):
+    """
+    Combined scores in [0, 1] of already cleaned comment texts, see score_comments.
+    With routes from clean_comments, the multilingual comments are scored by the multilingual model alone
+    (VADER only knows English) in a batch of their own.
+    With dedup (dedup_comments by default), near-duplicate texts (copy-pasted bot replies) are collapsed with
+    MinHash/LSH and only one representative per group is scored; every member gets its score, so a group
+    weighs in the overall sentiment with the like weights of all its members.
+    """
+    if (dedup_comments if dedup is None else dedup) and len(cleaned_comments_str) > 1:
+        start = time.perf_counter()
+        representatives, _, inverse = collapse_near_duplicates(cleaned_comments_str)
+        stage_timings.add("dedup", time.perf_counter() - start, len(cleaned_comments_str))
+        if len(representatives) < len(cleaned_comments_str):
+            unique_routes = None if routes is None else routes[representatives]
+            unique_texts = [cleaned_comments_str[i] for i in representatives]
+            return score_texts(unique_texts, roberta_weight, vader_weight, workers, cascade, gates, unique_routes, dedup=False)[inverse]
+    scores = np.empty(len(cleaned_comments_str))
+    routes = np.full(len(cleaned_comments_str), "main", dtype=object) if routes is None else routes
+    for route in ("main", "multilingual"):
+        indices = np.flatnonzero(routes == route)
+        if not len(indices): continue
+        start = time.perf_counter()
+        texts = [cleaned_comments_str[i] for i in indices]
+        if route == "main":
+            scores[indices] = _score_main(texts, roberta_weight, vader_weight, workers, cascade, gates)
+        else:
+            scores[indices] = (np.asarray(calculate_roberta_sentiment_scores(texts, model=multilingual)) + 1) / 2
+        language_stats.add_time(route, time.perf_counter() - start)
+    return scores
 
-    roberta_sentiments = calculate_roberta_sentiment_scores(cleaned_comments_str)
+def _score_main(cleaned_comments_str, roberta_weight, vader_weight, workers, cascade, gates):
+    if cascade:
+        polarity = batch_vader.polarity_scores(cleaned_comments_str)
+        combined_scores = np.array([p["compound"] for p in polarity])
+        uncertain = np.flatnonzero(transformer_mask(cleaned_comments_str, polarity, gates))
+        cascade_stats.add(len(cleaned_comments_str), len(cleaned_comments_str) - len(uncertain))
+        if len(uncertain):
+            roberta_sentiments = calculate_roberta_sentiment_scores([cleaned_comments_str[i] for i in uncertain], workers=workers)
+            combined_scores[uncertain] = combine_scores(roberta_sentiments, combined_scores[uncertain], roberta_weight, vader_weight)
+        return (combined_scores + 1) / 2
+    roberta_sentiments = calculate_roberta_sentiment_scores(cleaned_comments_str, workers=workers)
     vader_sentiments = calculate_vader_sentiment_scores(cleaned_comments_str)
     combined_scores = combine_scores(roberta_sentiments, vader_sentiments, roberta_weight, vader_weight)
-    combined_scores = (combined_scores + 1) / 2
-    likes = [comment['likes'] for comment in cleaned_comments]
-    weighted_likes = np.log1p(likes) + 1e-9
+    return (combined_scores + 1) / 2
+
+def unique_comments(comments) -> List[Tuple[object, int]]:
+    "One (comment, copies) per group of near-duplicate comments (e.g. the cleaned comments of score_comments), to show the LLM every content once"
+    if not comments:
+        return []
+    representatives, multiplicity, _ = collapse_near_duplicates([stringify_tweet(comment) for comment in comments])
+    return [(comments[i], int(copies)) for i, copies in zip(representatives, multiplicity)]
+
+def weighted_sentiment(comments, scores) -> float:
+    "Like-weighted average of per-comment scores, nan if there is nothing to average"
+    if len(comments) == 0:
+        return float("nan")
+    weighted_likes = np.log1p(TweetBatch(comments).likes) + 1e-9
     weighted_normalised_likes = weighted_likes / np.linalg.norm(weighted_likes)
-    return cleaned_comments, np.average(combined_scores, weights=weighted_normalised_likes)
\ No newline at end of file
+    return np.average(scores, weights=weighted_normalised_likes)
+
+def calculate_overall_sentiment(comments, roberta_weight=0.8, vader_weight=0.2, workers=1, cascade=False, gates=None):
+    """
+    Calculate the overall sentiment of the comments.
+    workers > 1 runs RoBERTa on that many processes, for large comment sets on many-core CPUs.
+    cascade only runs RoBERTa where VADER is unsure, see score_comments and evaluate_cascade.
+    Comments are routed on their lang first: non-linguistic ones (und, zxx, q*) are dropped without inference,
+    other languages go to the multilingual model or are dropped, see clean_comments and language_stats.
+    Return the overall sentiment score in [0, 1].
+    """
+    cleaned_comments, combined_scores = score_comments(comments, roberta_weight, vader_weight, workers, cascade, gates)
+    return cleaned_comments, weighted_sentiment(cleaned_comments, combined_scores)
+
+def calculate_overall_sentiment_many(comments_by_tweet: Dict[str, list], roberta_weight=0.8, vader_weight=0.2, workers=1, cascade=False, gates=None) -> Dict[str, Tuple[list, float]]:
+    """
+    calculate_overall_sentiment for many tweets (of any number of users) at once, e.g. from twitter.get_comments_many.
+    The comments of all tweets are cleaned and scored as one stream so the model runs full batches,
+    then the like-weighted average of every tweet is a segmented reduction over the stream.
+    Return {tweet_id: (cleaned_comments, overall sentiment in [0, 1])}, nan for tweets with nothing to score.
+    """
+    tweet_ids = list(comments_by_tweet)
+    cleaned_comments, segments, scores, weights, bounds = _score_segments([comments_by_tweet[tweet_id] for tweet_id in tweet_ids], roberta_weight, vader_weight, workers, cascade, gates)
+    totals = np.bincount(segments, weights=weights * scores, minlength=len(tweet_ids))
+    norms = np.bincount(segments, weights=weights, minlength=len(tweet_ids))
+    overall = np.divide(totals, norms, out=np.full(len(tweet_ids), np.nan), where=norms > 0)
+    return {
+        tweet_id: (cleaned_comments[bounds[k]:bounds[k + 1]], float(overall[k]))
+        for k, tweet_id in enumerate(tweet_ids)
+    }
+
+def _score_segments(groups: List[list], roberta_weight, vader_weight, workers, cascade, gates):
+    """
+    Clean and score the comments of several groups as one stream.
+    Return the cleaned comments, their group, score and like weight, and the bounds of every group's run.
+    """
+    comments = [comment for group in groups for comment in group]
+    segments = np.repeat(np.arange(len(groups)), [len(group) for group in groups])
+    kept, cleaned_comments_str, routes = clean_comments(comments)
+    scores = score_texts(cleaned_comments_str, roberta_weight, vader_weight, workers, cascade, gates, routes)
+    cleaned_comments = [comments[i] for i in kept]
+    weights = np.log1p(TweetBatch(cleaned_comments).likes) + 1e-9 # same weights as weighted_sentiment
+    # kept is in stream order, so every group's comments are one contiguous run
+    bounds = np.searchsorted(segments[kept], np.arange(len(groups) + 1))
+    return cleaned_comments, segments[kept], scores, weights, bounds
+
+def calculate_overall_sentiment_adaptive(tweet_ids: Iterable, fetch_pages: Callable[[Dict[str, str]], Dict[str, Tuple[list, str]]],
+                                         target_width: float = DEFAULT_SAMPLING["target_width"], confidence: float = DEFAULT_SAMPLING["confidence"],
+                                         min_comments: int = DEFAULT_SAMPLING["min_comments"], max_pages: int = DEFAULT_SAMPLING["max_pages"], max_requests: int = None,
+                                         roberta_weight=0.8, vader_weight=0.2, workers=1, cascade=False, gates=None) -> Dict[str, Tuple[list, float, Dict[str, Any]]]:
+    """
+    Sequential sampling of the comments of many tweets: page until each tweet's sentiment is known well enough.
+    fetch_pages takes {tweet_id: cursor} and returns {tweet_id: (comments, next_cursor)}, e.g. twitter.fetch_comments_pages.
+    Every round fetches the next page of every open tweet, scores all new comments as one stream and updates each
+    tweet's like-weighted mean and its confidence interval. A tweet closes once the interval is narrower than
+    target_width (with at least min_comments), its comments run out, or it has used max_pages requests.
+    max_requests caps the requests over all tweets; rounds then go to the widest intervals first.
+    Return {tweet_id: (cleaned_comments, overall sentiment in [0, 1], info)}, info holding the pages, comments,
+    interval, why paging stopped ("converged", "exhausted" or "budget") and the scores and weights of the comments.
+    """
+    tweet_ids = [str(tweet_id) for tweet_id in tweet_ids]
+    budget = max_pages * len(tweet_ids) if max_requests is None else max_requests
+    state = {tweet_id: {"cursor": "", "pages": 0, "comments": [], "scores": [], "weights": [], "interval": (float("nan"), float("-inf"), float("inf")), "stopped": None} for tweet_id in tweet_ids}
+    requests = 0
+    while open_ids := [tweet_id for tweet_id in tweet_ids if state[tweet_id]["stopped"] is None]:
+        if requests >= budget:
+            for tweet_id in open_ids: state[tweet_id]["stopped"] = "budget"
+            break
+        open_ids.sort(key=lambda tweet_id: state[tweet_id]["interval"][1] - state[tweet_id]["interval"][2]) # widest first
+        open_ids = open_ids[:budget - requests]
+        pages = fetch_pages({tweet_id: state[tweet_id]["cursor"] for tweet_id in open_ids})
+        requests += len(open_ids)
+        cleaned_comments, _, scores, weights, bounds = _score_segments([pages[tweet_id][0] for tweet_id in open_ids], roberta_weight, vader_weight, workers, cascade, gates)
+        for k, tweet_id in enumerate(open_ids):
+            tweet = state[tweet_id]
+            tweet["comments"].extend(cleaned_comments[bounds[k]:bounds[k + 1]])
+            tweet["scores"].append(scores[bounds[k]:bounds[k + 1]])
+            tweet["weights"].append(weights[bounds[k]:bounds[k + 1]])
+            tweet["cursor"] = pages[tweet_id][1]
+            tweet["pages"] += 1
+            tweet["interval"] = weighted_mean_interval(np.concatenate(tweet["scores"]), np.concatenate(tweet["weights"]), confidence)
+            if len(tweet["comments"]) >= min_comments and tweet["interval"][2] - tweet["interval"][1] <= target_width:
+                tweet["stopped"] = "converged"
+            elif not tweet["cursor"]:
+                tweet["stopped"] = "exhausted"
+            elif tweet["pages"] >= max_pages:
+                tweet["stopped"] = "budget"
+
+    results = {}
+    for tweet_id in tweet_ids:
+        tweet = state[tweet_id]
+        mean, low, high = tweet["interval"]
+        info = {"pages": tweet["pages"], "comments": len(tweet["comments"]), "low": low, "high": high, "width": high - low, "stopped": tweet["stopped"],
+                "scores": np.concatenate(tweet["scores"]) if tweet["scores"] else np.zeros(0), "weights": np.concatenate(tweet["weights"]) if tweet["weights"] else np.zeros(0)}
+        results[tweet_id] = (tweet["comments"], mean, info)
+    return results
+
+def evaluate_cascade(comments, gates=None, roberta_weight=0.8, vader_weight=0.2):
+    """
+    Measure what the cascade costs in accuracy on a comment set: the overall sentiment with and without it,
+    their difference, and the share of comments that skipped RoBERTa.
+    """
+    _, full = calculate_overall_sentiment(comments, roberta_weight, vader_weight)
+    before = cascade_stats.stats()
+    _, cascaded = calculate_overall_sentiment(comments, roberta_weight, vader_weight, cascade=True, gates=gates)
+    after = cascade_stats.stats()
+    texts = after["texts"] - before["texts"]
+    return {
+        "full": float(full),
+        "cascade": float(cascaded),
+        "abs_error": float(abs(full - cascaded)),
+        "texts": texts,
+        "skip_fraction": (after["skipped"] - before["skipped"]) / texts if texts else 0.0,
+    }
+
+def calculate_overall_sentiment_stream(pages, roberta_weight=0.8, vader_weight=0.2, workers=1, cascade=False, gates=None):
+    """
+    calculate_overall_sentiment over pages of comments, e.g. from twitter.iter_comments.
+    Each page is scored as soon as it arrives; wrap the pages in twitter.utils.prefetch
+    to fetch the next page while the model works on the current one.
+    Pages may be lists of comments or (comments, cursor) tuples.
+    """
+    cleaned_comments = []
+    page_scores = [np.empty(0)]
+    for page in pages:
+        if isinstance(page, tuple): page = page[0]
+        page_comments, scores = score_comments(page, roberta_weight, vader_weight, workers, cascade, gates)
+        cleaned_comments.extend(page_comments)
+        page_scores.append(scores)
+    return cleaned_comments, weighted_sentiment(cleaned_comments, np.concatenate(page_scores))
\ No newline at end of file
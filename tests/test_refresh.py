@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import pytest
+
+import twitter.scraper as scraper
+from twitter.store import TweetStore
+from twitter.utils import Tweet, ms_to_snowflake
+
+def _result(tweet_id: int) -> dict:
+    return {
+        "__typename": "Tweet",
+        "rest_id": str(tweet_id),
+        "views": {},
+        "core": {"user_results": {"result": {"rest_id": "1", "core": {"name": "Author", "screen_name": "author"}, "legacy": {"description": ""}}}},
+        "legacy": {"full_text": f"tweet {tweet_id}", "bookmark_count": 0, "reply_count": 0, "retweet_count": 0, "favorite_count": 0, "created_at": "", "lang": "en"},
+    }
+
+def _tweet_entry(tweet_id: int) -> dict:
+    return {"entryId": f"tweet-{tweet_id}", "content": {"entryType": "TimelineTimelineItem", "itemContent": {"tweet_results": {"result": _result(tweet_id)}}}}
+
+def _conversation_entry(*tweet_ids: int) -> dict:
+    items = [{"entryId": f"profile-conversation-{tweet_ids[0]}-tweet-{tweet_id}", "item": {"itemContent": {"tweet_results": {"result": _result(tweet_id)}}}} for tweet_id in tweet_ids]
+    return {"entryId": f"profile-conversation-{tweet_ids[0]}", "content": {"entryType": "TimelineTimelineModule", "items": items}}
+
+def _cursor_entry(value: str) -> dict:
+    return {"entryId": f"cursor-bottom-{value or 'end'}", "content": {"value": value}}
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = TweetStore(tmp_path / "tweets.db")
+    monkeypatch.setattr(scraper, "tweet_store", store)
+    return store
+
+def test_timeline_positions_use_the_newest_tweet_of_a_conversation():
+    entries = [_conversation_entry(150, 310), _tweet_entry(300), _cursor_entry("next")]
+    assert scraper.timeline_positions(entries) == [310, 300]
+
+def test_refresh_pages_past_old_tweets_in_a_conversation_module(store, monkeypatch):
+    # stored by an earlier run, watermark at 200
+    store.save("1", [Tweet(str(tweet_id), f"tweet {tweet_id}", "") for tweet_id in (200, 190, 150)], newest_id=200, oldest_id=150, oldest_cursor="")
+    # since then: a reply (310) to the stored 150 brings 150 to the top of the first page, 250 is on the second
+    pages = {
+        "": [_conversation_entry(150, 310), _tweet_entry(300), _cursor_entry("2")],
+        "2": [_tweet_entry(250), _tweet_entry(200), _tweet_entry(190), _cursor_entry("3")],
+    }
+    requested = []
+
+    async def fetch_entries(user_id, cursor=""):
+        requested.append(cursor)
+        return pages[cursor]
+
+    monkeypatch.setattr(scraper, "afetch_user_tweets_entries", fetch_entries)
+    tweets = asyncio.run(scraper.arefresh_user_tweets("1"))
+    assert requested == ["", "2"]
+    assert [tweet.tweet_id for tweet in tweets] == ["310", "300", "250", "200", "190", "150"]
+    assert store.watermark("1")["newest_id"] == 310
+
+def test_refresh_without_pages_filters_and_caps_the_stored_history(store, monkeypatch):
+    recent = ms_to_snowflake((time.time() - 3600) * 1000)
+    store.save("1", [Tweet(str(tweet_id), f"tweet {tweet_id}", "") for tweet_id in (recent, 200, 190, 150)], newest_id=recent, oldest_id=150, oldest_cursor="")
+
+    async def fetch_entries(user_id, cursor=""):
+        raise AssertionError("no UserTweets pages were granted")
+
+    monkeypatch.setattr(scraper, "afetch_user_tweets_entries", fetch_entries)
+    capped = asyncio.run(scraper.arefresh_user_tweets("1", minimum_tweets=2, max_pages=0))
+    assert [tweet.tweet_id for tweet in capped] == [str(recent), "200"]
+    within_period = asyncio.run(scraper.arefresh_user_tweets("1", period="day=1", max_pages=0))
+    assert [tweet.tweet_id for tweet in within_period] == [str(recent)]
+    assert asyncio.run(scraper.arefresh_user_tweets("2", max_pages=0)) == []
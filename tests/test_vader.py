@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+from sentiment.vader import BatchVader, check_parity
+
+CORPUS = [
+    # plain
+    "This is a great launch",
+    "Terrible earnings, I am selling",
+    "The rocket launched today.",
+    "",
+    "   ",
+    # negation
+    "This is not good at all",
+    "I don't think this is bad",
+    "Never a dull moment with this company",
+    "Nobody hates this product",
+    "It isn't great, it isn't terrible",
+    "without doubt the best quarter",
+    # "but"
+    "The product is great but the price is awful",
+    "Bad quarter but a great outlook",
+    "I love it, but I won't buy it",
+    # caps and punctuation
+    "This is GREAT!!!",
+    "this is AWFUL",
+    "GOOD GOOD GOOD",
+    "What a wonderful day!!!?",
+    "Seriously??? Best. Launch. Ever.",
+    # boosters, idioms, special cases
+    "This is extremely good",
+    "Kind of a mess honestly",
+    "The stock is the bomb",
+    "Yeah right, that went well",
+    "the shit",
+    "Cut the mustard, they did not",
+    "hand to mouth company",
+    # emoji and emoticons
+    "To the moon 🚀🚀🚀",
+    "Great results 😀",
+    "Awful guidance 😡😡",
+    "Not sure 🤔 but ok :)",
+    "sad day :( :(",
+    "Love this ❤️",
+    # mixed
+    "Q3 beat: revenue +25% y/y, margins down. Still bullish!",
+    "@RocketLab not impressed, delays again... #fail",
+    "https://t.co/abc lol this is hilarious",
+    "Meh.",
+]
+
+@pytest.fixture(scope="module")
+def vader():
+    return BatchVader(SentimentIntensityAnalyzer())
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_polarity_scores_match_the_reference(vader, text):
+    batch = vader.scores([text])
+    reference = vader.analyzer.polarity_scores(text)
+    for key in ("neg", "neu", "pos", "compound"):
+        assert batch[key][0] == pytest.approx(reference[key], abs=1e-9), key
+
+def test_whole_corpus_at_once(vader):
+    report = check_parity(CORPUS * 3, vader)
+    assert max(report["max_abs_diff"].values()) <= 1e-9
+    assert not report["mismatches"]
+    assert np.allclose(vader.compound(CORPUS), [vader.analyzer.polarity_scores(text)["compound"] for text in CORPUS], atol=1e-9)
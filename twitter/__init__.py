@@ -1,3 +1,10 @@
 from .scraper import *
+from .ratelimit import *
+from .session import *
+from .cache import *
+from .store import *
+from .scheduler import *
+from .archive import *
+from .transaction import *
 from .tools import *
 from .utils import *
\ No newline at end of file
@@ -0,0 +1,202 @@
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Union, Iterable, Sequence
+
+import numpy as np
+
+from .utils import Tweet, snowflake_to_ms
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+except ImportError: # only needed for the archive
+    pa = None
+
+ARCHIVE_PATH = Path(__file__).parent / ".cache" / "archive"
+KINDS = ("tweets", "comments", "scores")
+_NESTED = ("quoted_tweet", "retweeted_tweet")
+
+if pa is not None:
+    _TWEET_FIELDS = [
+        ("tweet_id", pa.int64()),
+        ("timestamp", pa.timestamp("ms", tz="UTC")), # decoded from the id
+        ("created_at", pa.string()),
+        ("text", pa.string()),
+        ("lang", pa.string()),
+        ("views", pa.string()),
+        ("likes", pa.int64()),
+        ("replies", pa.int64()),
+        ("retweets", pa.int64()),
+        ("quotes", pa.int64()),
+        ("bookmarks", pa.int64()),
+        ("user_rest_id", pa.string()),
+        ("user_name", pa.string()),
+        ("user_screen_name", pa.string()),
+        ("user_bio", pa.string()),
+        ("post_image_description", pa.string()),
+        ("post_video_description", pa.string()),
+        ("replying_to", pa.string()),
+        ("quoted_tweet", pa.string()), # json of the nested tweet
+        ("retweeted_tweet", pa.string()),
+    ]
+    SCHEMAS = {
+        "tweets": pa.schema(_TWEET_FIELDS + [("scraped_at", pa.timestamp("ms", tz="UTC"))]),
+        "comments": pa.schema(_TWEET_FIELDS + [("parent_id", pa.int64()), ("scraped_at", pa.timestamp("ms", tz="UTC"))]),
+        "scores": pa.schema([
+            ("tweet_id", pa.int64()), # the comment
+            ("parent_id", pa.int64()), # the tweet it replies to
+            ("timestamp", pa.timestamp("ms", tz="UTC")),
+            ("score", pa.float64()), # in [0, 1]
+            ("weight", pa.float64()), # like weight in the overall sentiment
+            ("scorer", pa.string()),
+            ("scraped_at", pa.timestamp("ms", tz="UTC")),
+        ]),
+    }
+    PARTITIONING = ds.partitioning(pa.schema([("target", pa.string()), ("date", pa.string())]), flavor="hive")
+
+class TweetArchive:
+    """
+    Columnar archive of everything a run scrapes, so analyses and backtests can go back months without re-scraping.
+    Tweets, comments and per-comment scores are appended to Parquet datasets partitioned by target and (UTC) date
+    of the tweet: <path>/<kind>/target=<target>/date=<YYYY-MM-DD>/part-*.parquet. Every append is kept with its
+    scraped_at, so engagement can be followed between runs; latest() keeps the newest row per tweet.
+    table() reads partitions through memory-mapped files, pruned by target and date; mapped() serves a whole kind
+    from an Arrow IPC snapshot mapped into memory, whose columns are views of the file (zero copy).
+    Needs pyarrow.
+    """
+    def __init__(self, path: Union[str, Path] = ARCHIVE_PATH):
+        self.path = Path(path)
+
+    @property
+    def enabled(self) -> bool:
+        return pa is not None
+
+    def _require(self):
+        if pa is None:
+            raise Exception("The tweet archive needs pyarrow, pip install pyarrow")
+
+    def _rows(self, tweets: Sequence[Tweet], scraped_at: int) -> Dict[str, Any]:
+        columns = {name: [getattr(tweet, name) for tweet in tweets] for name, _ in _TWEET_FIELDS if name not in ("tweet_id", "timestamp") + _NESTED}
+        for name in _NESTED:
+            columns[name] = [json.dumps(getattr(tweet, name).to_dict(), ensure_ascii=False) if getattr(tweet, name) is not None else None for tweet in tweets]
+        columns["tweet_id"] = np.array([int(tweet.tweet_id) for tweet in tweets], dtype=np.int64)
+        columns["timestamp"] = snowflake_to_ms(columns["tweet_id"])
+        columns["scraped_at"] = np.full(len(tweets), scraped_at, dtype=np.int64)
+        return columns
+
+    def _append(self, kind: str, target: str, columns: Dict[str, Any]):
+        "Write one table of rows under their target/date partitions"
+        schema = SCHEMAS[kind]
+        table = pa.table({name: pa.array(columns[name], type=schema.field(name).type) for name in schema.names}, schema=schema)
+        if not len(table):
+            return
+        dates = np.asarray(columns["timestamp"], dtype="datetime64[ms]").astype("datetime64[D]").astype(str)
+        table = table.append_column("target", pa.array([target] * len(table), pa.string())).append_column("date", pa.array(dates, pa.string()))
+        ds.write_dataset(table, str(self.path / kind), format="parquet", partitioning=PARTITIONING,
+                         basename_template=f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore")
+
+    def append_tweets(self, target: str, tweets: Iterable[Tweet]):
+        self._require()
+        tweets = list(tweets)
+        self._append("tweets", target, self._rows(tweets, int(time.time() * 1000)))
+
+    def append_comments(self, target: str, tweet_id: Union[str, int], comments: Iterable[Tweet]):
+        "Comments of tweet_id"
+        self._require()
+        comments = list(comments)
+        columns = self._rows(comments, int(time.time() * 1000))
+        columns["parent_id"] = np.full(len(comments), int(tweet_id), dtype=np.int64)
+        self._append("comments", target, columns)
+
+    def append_scores(self, target: str, tweet_id: Union[str, int], comments: Sequence[Tweet], scores: Sequence[float], weights: Optional[Sequence[float]] = None, scorer: str = ""):
+        "Scores of the comments of tweet_id, in the order of comments; weights default to the like weights of weighted_sentiment"
+        self._require()
+        if len(scores) != len(comments):
+            raise Exception(f"{len(scores)} scores for {len(comments)} comments")
+        ids = np.array([int(comment.tweet_id) for comment in comments], dtype=np.int64)
+        if weights is None:
+            weights = np.log1p(np.array([comment.likes for comment in comments], dtype=np.float64)) + 1e-9
+        self._append("scores", target, {
+            "tweet_id": ids,
+            "parent_id": np.full(len(ids), int(tweet_id), dtype=np.int64),
+            "timestamp": snowflake_to_ms(ids),
+            "score": np.asarray(scores, dtype=np.float64),
+            "weight": np.asarray(weights, dtype=np.float64),
+            "scorer": [scorer] * len(ids),
+            "scraped_at": np.full(len(ids), int(time.time() * 1000), dtype=np.int64),
+        })
+
+    def dataset(self, kind: str) -> "ds.Dataset":
+        "The Parquet dataset of a kind, files opened memory mapped"
+        self._require()
+        if kind not in KINDS:
+            raise Exception(f"Unknown archive kind {kind}, expected one of {KINDS}")
+        root = self.path / kind
+        if not root.exists(): # nothing archived yet, an empty table with the same columns
+            schema = pa.unify_schemas([SCHEMAS[kind], PARTITIONING.schema])
+            return ds.dataset(schema.empty_table())
+        return ds.dataset(str(root), format="parquet", partitioning=PARTITIONING, filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+
+    def table(self, kind: str, targets: Optional[Sequence[str]] = None, start: Optional[str] = None, end: Optional[str] = None, columns: Optional[List[str]] = None) -> "pa.Table":
+        """
+        Rows of a kind for targets with start <= date <= end (ISO dates, both inclusive), only reading the
+        partitions and columns asked for. table(...).to_pandas() for a DataFrame.
+        """
+        dataset = self.dataset(kind)
+        condition = None
+        for part in (
+            pc.field("target").isin(list(targets)) if targets is not None else None,
+            pc.field("date") >= start if start else None,
+            pc.field("date") <= end if end else None,
+        ):
+            if part is not None:
+                condition = part if condition is None else condition & part
+        return dataset.to_table(columns=columns, filter=condition)
+
+    def mapped(self, kind: str) -> "pa.Table":
+        """
+        The whole of a kind as a table backed by a memory-mapped Arrow IPC snapshot, rewritten only when a partition
+        changed since. Nothing is decoded or copied until a column is used, so it stays cheap however large the archive.
+        """
+        self._require()
+        root = self.path / kind
+        snapshot = self.path / "snapshots" / f"{kind}.arrow"
+        parts = list(root.rglob("*.parquet")) if root.exists() else []
+        newest = max((part.stat().st_mtime_ns for part in parts), default=0)
+        if not snapshot.exists() or snapshot.stat().st_mtime_ns < newest:
+            dataset = self.dataset(kind)
+            snapshot.parent.mkdir(parents=True, exist_ok=True)
+            partial = snapshot.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+            with pa.OSFile(str(partial), "wb") as sink, pa.ipc.new_file(sink, dataset.schema) as writer: # uncompressed, so it can be mapped
+                for batch in dataset.to_batches():
+                    writer.write_batch(batch)
+            os.replace(partial, snapshot)
+        return pa.ipc.open_file(pa.memory_map(str(snapshot))).read_all()
+
+def latest(table: "pa.Table", keys: Sequence[str] = ("tweet_id",)) -> "pa.Table":
+    "The newest row (by scraped_at) per keys, e.g. each tweet with its engagement as last scraped"
+    if not len(table):
+        return table
+    order = np.lexsort([-table["scraped_at"].cast(pa.int64()).to_numpy()] + [table[key].to_numpy() for key in reversed(keys)])
+    key_rows = np.stack([table[key].to_numpy()[order] for key in keys], axis=1)
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = np.any(key_rows[1:] != key_rows[:-1], axis=1)
+    return table.take(pa.array(order[first]))
+
+def to_tweets(table: "pa.Table") -> List[Tweet]:
+    "Tweet objects back from rows of the tweets or comments kind"
+    tweets = []
+    for row in table.select([name for name in Tweet.__slots__ if name in table.column_names]).to_pylist():
+        row["tweet_id"] = str(row["tweet_id"])
+        for name in _NESTED:
+            if row.get(name) is not None:
+                row[name] = json.loads(row[name])
+        tweets.append(Tweet.from_dict(row))
+    return tweets
+
+tweet_archive = TweetArchive()
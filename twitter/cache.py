@@ -0,0 +1,126 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, Union
+
+import zstandard
+
+CACHE_PATH = Path(__file__).parent / ".cache" / "responses.db"
+DEFAULT_TTLS = { # seconds a cached page stays fresh
+    "UserTweets": 15 * 60,
+    "TweetDetail": 30 * 60,
+    "SearchTimeline": 6 * 60 * 60,
+}
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CACHE_MODES = ("off", "readwrite", "replay")
+
+class CacheMiss(Exception):
+    "Raised in replay mode when a request has not been recorded"
+
+class ResponseCache:
+    """
+    On-disk cache of GraphQL response bodies, keyed by endpoint + variables (the cursor is part of the variables).
+    Bodies are stored zstd-compressed in SQLite, expire per endpoint TTL and are evicted least-recently-used
+    once the cache grows past max_bytes.
+    Modes:
+        off: bypass the cache
+        readwrite: serve fresh hits, record everything fetched
+        replay: serve recorded responses regardless of age, never touch the network (misses raise CacheMiss)
+    """
+    def __init__(self, path: Union[str, Path] = CACHE_PATH, ttls: Dict[str, float] = DEFAULT_TTLS, max_bytes: int = DEFAULT_MAX_BYTES, mode: str = "readwrite"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {mode}, expected one of {CACHE_MODES}")
+        self.path = Path(path)
+        self.ttls = dict(ttls)
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._size = 0
+        self._compressor = zstandard.ZstdCompressor(level=3)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def _connect(self) -> sqlite3.Connection:
+        # opened on first use so importing the scraper does not touch the disk
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    body BLOB NOT NULL
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return self._db
+
+    @staticmethod
+    def key(endpoint: str, variables: Dict[str, Any]) -> str:
+        return hashlib.sha1((endpoint + json.dumps(variables, sort_keys=True, separators=(',', ':'))).encode()).hexdigest()
+
+    def get(self, endpoint: str, variables: Dict[str, Any]) -> Optional[dict]:
+        "Return the cached body or None. In replay mode a miss raises CacheMiss."
+        if self.mode == "off":
+            return None
+        key = self.key(endpoint, variables)
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT created_at, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and (self.mode == "replay" or time.time() - row[0] <= self.ttls.get(endpoint, 0)):
+                db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            else:
+                row = None
+        if row is None:
+            if self.mode == "replay":
+                raise CacheMiss(f"No recorded response for {endpoint} {json.dumps(variables)}")
+            return None
+        return json.loads(self._decompressor.decompress(row[1]))
+
+    def put(self, endpoint: str, variables: Dict[str, Any], body: Union[bytes, str]):
+        "Record a raw json body"
+        if self.mode != "readwrite" or self.ttls.get(endpoint, 0) <= 0:
+            return
+        if isinstance(body, str):
+            body = body.encode()
+        compressed = self._compressor.compress(body)
+        key = self.key(endpoint, variables)
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            old = db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            db.execute("INSERT OR REPLACE INTO responses (key, endpoint, created_at, accessed_at, size, body) VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, endpoint, now, now, len(compressed), compressed))
+            self._size += len(compressed) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict(db)
+
+    def _evict(self, db: sqlite3.Connection):
+        # drop least recently used entries until we are comfortably below the limit
+        target = self.max_bytes * 0.9
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if self._size <= target: break
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._size -= size
+
+    def clear(self, endpoint: Optional[str] = None):
+        with self._lock:
+            db = self._connect()
+            if endpoint:
+                db.execute("DELETE FROM responses WHERE endpoint = ?", (endpoint,))
+            else:
+                db.execute("DELETE FROM responses")
+            self._size = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            db = self._connect()
+            entries = dict(db.execute("SELECT endpoint, COUNT(*) FROM responses GROUP BY endpoint").fetchall())
+            return {"mode": self.mode, "bytes": self._size, "max_bytes": self.max_bytes, "entries": entries}
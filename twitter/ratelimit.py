@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+from typing import Optional, Dict, Any
+
+RATE_LIMIT_WINDOW = 15 * 60 # X resets its GraphQL limits every 15 minutes
+DEFAULT_LIMITS = { # requests per window, used until the first response tells us the real numbers
+    "UserTweets": 50,
+    "TweetDetail": 150,
+    "SearchTimeline": 50,
+}
+POLL_INTERVAL = 1.0
+
+class TokenBucket:
+    """
+    Token bucket for a single endpoint.
+    Before any response has been seen it refills continuously at limit/window.
+    Once x-rate-limit-* headers arrive the server is authoritative: the bucket holds
+    `remaining` minus what we have sent since, and refills to `limit` at `reset_at`.
+    """
+    def __init__(self, limit: int, window: float = RATE_LIMIT_WINDOW):
+        self.limit = limit
+        self.window = window
+        self.tokens = float(limit)
+        self.reset_at: Optional[float] = None # unix time reported by the server
+        self.updated_at = time.time()
+
+    def _refill(self, now: float):
+        if self.reset_at is not None:
+            if now >= self.reset_at:
+                self.tokens = float(self.limit)
+                self.reset_at = None
+                self.updated_at = now
+            return
+        self.tokens = min(float(self.limit), self.tokens + (now - self.updated_at) * self.limit / self.window)
+        self.updated_at = now
+
+    def reserve(self, now: float) -> float:
+        "Take a token if one is available and return 0, otherwise return how long to wait before trying again"
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.reset_at is not None:
+            return min(max(self.reset_at - now, 0.0), self.window)
+        return min((1 - self.tokens) * self.window / self.limit, self.window)
+
+    def update(self, limit: Optional[int], remaining: Optional[int], reset_at: Optional[float], now: float):
+        self._refill(now)
+        if limit:
+            self.limit = limit
+        if remaining is not None:
+            # within the same window, requests still in flight are already off our count but not the server's
+            same_window = self.reset_at is not None and self.reset_at == reset_at
+            self.tokens = min(self.tokens, float(remaining)) if same_window else float(remaining)
+        if reset_at is not None and reset_at > now:
+            self.reset_at = reset_at
+        self.updated_at = now
+
+    def seconds_until_reset(self, now: float) -> float:
+        if self.reset_at is None:
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) * self.window / self.limit
+        return max(self.reset_at - now, 0.0)
+
+class RateLimiter:
+    """
+    Per-endpoint token buckets fed by the x-rate-limit-limit/-remaining/-reset response headers.
+    Requests wait for a token before they are sent, so we pace ourselves instead of running into 429s,
+    and a wait never exceeds the endpoint's reset window.
+    Safe to share between threads and event loops.
+    """
+    def __init__(self, default_limits: Dict[str, int] = DEFAULT_LIMITS, window: float = RATE_LIMIT_WINDOW):
+        self.default_limits = dict(default_limits)
+        self.window = window
+        self.buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, endpoint: str) -> TokenBucket:
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            bucket = self.buckets[endpoint] = TokenBucket(self.default_limits.get(endpoint, 50), self.window)
+        return bucket
+
+    def reserve(self, endpoint: str) -> float:
+        "Non-blocking acquire: 0 if a token was taken, otherwise the number of seconds to wait"
+        with self._lock:
+            return self._bucket(endpoint).reserve(time.time())
+
+    async def acquire(self, endpoint: str):
+        # sleep in short steps so waiters notice when a response moves the budget or the reset
+        while (wait := self.reserve(endpoint)) > 0:
+            await asyncio.sleep(min(wait, POLL_INTERVAL))
+
+    def update(self, endpoint: str, headers: Any):
+        "Sync the bucket with a response's rate limit headers"
+        limit = _int_header(headers, 'x-rate-limit-limit')
+        remaining = _int_header(headers, 'x-rate-limit-remaining')
+        reset_at = _int_header(headers, 'x-rate-limit-reset')
+        if limit is None and remaining is None and reset_at is None:
+            return
+        with self._lock:
+            self._bucket(endpoint).update(limit, remaining, reset_at, time.time())
+
+    def exhaust(self, endpoint: str, headers: Any = None):
+        "Mark an endpoint as out of budget, e.g. after a 429"
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            now = time.time()
+            reset_at = _int_header(headers, 'x-rate-limit-reset') if headers is not None else None
+            bucket.update(None, 0, reset_at or int(now + self.window), now)
+
+    def seconds_until_reset(self, endpoint: str) -> float:
+        with self._lock:
+            return self._bucket(endpoint).seconds_until_reset(time.time())
+
+    def budget(self, endpoint: str) -> Dict[str, Any]:
+        "Current budget for an endpoint: {'limit', 'remaining', 'reset_in'}"
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            now = time.time()
+            bucket._refill(now)
+            return {
+                "limit": bucket.limit,
+                "remaining": int(bucket.tokens),
+                "reset_in": round(bucket.seconds_until_reset(now), 1),
+            }
+
+    def budgets(self) -> Dict[str, Dict[str, Any]]:
+        return {endpoint: self.budget(endpoint) for endpoint in set(self.default_limits) | set(self.buckets)}
+
+def _int_header(headers: Any, name: str) -> Optional[int]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return int(value)
+    except ValueError:
+        return None
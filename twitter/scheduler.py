@@ -0,0 +1,116 @@
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Optional, Dict, Any, Iterable, Iterator, Tuple
+
+import numpy as np
+
+from .utils import Tweet, TweetBatch
+
+DEFAULT_BUDGET = { # requests per run, shared by every user analysed in it
+    "UserTweets": 40,
+    "TweetDetail": 120,
+}
+RECENCY_DECAY = 0.7 # as relevancy_score in lab.ipynb: 1.0 is a linear penalty per day, smaller cares less about age
+
+_current_user: "contextvars.ContextVar[Optional[Tuple[RequestScheduler, str]]]" = contextvars.ContextVar("scheduler_user", default=None)
+
+def record_request(endpoint: str):
+    "Count a request against the user the calling context is tracked for, see RequestScheduler.track"
+    tracked = _current_user.get()
+    if tracked is not None:
+        scheduler, user = tracked
+        scheduler.record(user, endpoint)
+
+def expected_values(tweets: Iterable[Tweet], now: Optional[float] = None, decay: float = RECENCY_DECAY) -> np.ndarray:
+    """
+    What fetching a tweet's comments is worth, lab.ipynb's relevancy_score extended with engagement:
+    replies (the comments there are to read) scaled up by log engagement and down by age in days ** decay.
+    """
+    batch = tweets if isinstance(tweets, TweetBatch) else TweetBatch(tweets)
+    age_days = ((now if now is not None else time.time()) * 1000 - batch.timestamps) / 86_400_000
+    engagement = np.log1p(batch.likes + batch.retweets + batch.quotes)
+    return batch.replies * (1 + engagement) / (np.maximum(age_days, 0) + 1) ** decay
+
+class RequestScheduler:
+    """
+    Per-run budget of requests per endpoint, handed out across the users of the run.
+    A user asks for a stage's requests with grant(); it gets a share of what is left in proportion to the
+    expected value of its work against the users that have not had that stage yet, so no single account can
+    use up the rate window, and what a user does not use goes back to the pool for the users after it.
+    track() counts the requests a user actually sends, report() has the spend per user.
+    Safe to share between the threads of a run.
+    """
+    def __init__(self, budget: Dict[str, int] = DEFAULT_BUDGET, users: Iterable[str] = ()):
+        self.budget = dict(budget)
+        self._lock = threading.Lock()
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.granted: Dict[str, int] = {endpoint: 0 for endpoint in self.budget} # handed out and not returned
+        self._waiting: Dict[str, Dict[str, float]] = {endpoint: {} for endpoint in self.budget} # users whose stage is still to come -> value
+        for user in users:
+            self.add_user(user)
+
+    def add_user(self, user: str):
+        with self._lock:
+            if user in self.users:
+                return
+            self.users[user] = {"requests": {}, "granted": {}, "tweets": 0, "comments": 0}
+            for waiting in self._waiting.values():
+                waiting[user] = None # value not known until the user asks
+
+    def remaining(self, endpoint: str) -> int:
+        with self._lock:
+            return self.budget[endpoint] - self.granted[endpoint]
+
+    def grant(self, user: str, endpoint: str, wanted: int, value: float = 1.0) -> int:
+        "How many of the wanted requests user may send for endpoint, at least 1 while the budget lasts"
+        self.add_user(user)
+        with self._lock:
+            waiting = self._waiting[endpoint]
+            waiting[user] = max(float(value), 1e-9)
+            known = [v for v in waiting.values() if v is not None]
+            default = sum(known) / len(known) # users still to come are assumed to be worth the average
+            total = sum(default if v is None else v for v in waiting.values())
+            left = self.budget[endpoint] - self.granted[endpoint]
+            share = int(round(left * waiting[user] / total)) if total else left
+            granted = max(0, min(wanted, left, max(share, 1)))
+            del waiting[user]
+            self.granted[endpoint] += granted
+            self.users[user]["granted"][endpoint] = self.users[user]["granted"].get(endpoint, 0) + granted
+            return granted
+
+    def settle(self, user: str, endpoint: str, tweets: int = 0, comments: int = 0):
+        "Close a user's stage: whatever it was granted but did not send goes back to the pool"
+        with self._lock:
+            stats = self.users[user]
+            unused = stats["granted"].get(endpoint, 0) - stats["requests"].get(endpoint, 0)
+            if unused > 0:
+                self.granted[endpoint] -= unused
+                stats["granted"][endpoint] -= unused
+            stats["tweets"] += tweets
+            stats["comments"] += comments
+
+    def record(self, user: str, endpoint: str):
+        "Count one request user sent to endpoint, from any thread"
+        with self._lock:
+            requests = self.users[user]["requests"]
+            requests[endpoint] = requests.get(endpoint, 0) + 1
+
+    @contextlib.contextmanager
+    def track(self, user: str) -> Iterator[None]:
+        "Count the requests sent from this context (including the event loops it starts) against user"
+        self.add_user(user)
+        token = _current_user.set((self, user))
+        try:
+            yield
+        finally:
+            _current_user.reset(token)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        "Per user: requests sent per endpoint, tweets and comments collected"
+        with self._lock:
+            return {
+                user: {"requests": dict(stats["requests"]), "tweets": stats["tweets"], "comments": stats["comments"]}
+                for user, stats in self.users.items()
+            }
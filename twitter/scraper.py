@@ -1,11 +1,15 @@
 
 
-from typing import Optional, Union, List, Dict, Any, Tuple
+from typing import Optional, Union, List, Dict, Any, Tuple, Iterable, Iterator, Callable, Awaitable, AsyncIterator
 from urllib.parse import urlencode 
 from urllib.parse import urlparse
+import asyncio, concurrent.futures, contextlib, contextvars, threading, time
 import datetime
-import rnet
 from .utils import *
+from .session import ScraperSession, SessionPool, AUTH_ERRORS, TRANSACTION_ERRORS
+from .cache import ResponseCache
+from .store import TweetStore
+from .scheduler import record_request
 import os, json
 
 def parse_tweet(result: dict) -> Optional[Tweet]:
@@ -13,55 +17,52 @@ def parse_tweet(result: dict) -> Optional[Tweet]:
         return None
     legacy = result['legacy']
     user_results = result['core']['user_results']['result']
-    tweet: Tweet = {
-        "text": legacy['full_text'],
-        "quotes": legacy['bookmark_count'],
-        "replies": legacy['reply_count'], 
-        "retweets": legacy['retweet_count'],
-        "likes": legacy['favorite_count'],
-        "created_at": legacy['created_at'],
-        "bookmarks": legacy['bookmark_count'],
-        "lang": legacy['lang'],
-        "tweet_id": result['rest_id'],
-        "views": result['views']['count'] if 'count' in result['views'] else "?",
+    tweet = Tweet(
+        text=legacy['full_text'],
+        quotes=legacy['bookmark_count'],
+        replies=legacy['reply_count'], 
+        retweets=legacy['retweet_count'],
+        likes=legacy['favorite_count'],
+        created_at=legacy['created_at'],
+        bookmarks=legacy['bookmark_count'],
+        lang=legacy['lang'],
+        tweet_id=result['rest_id'],
+        views=result['views']['count'] if 'count' in result['views'] else "?",
         
         # User Information
-        "user_rest_id": user_results['rest_id'],
-        "user_name": user_results['core']['name'],
-        "user_screen_name": user_results['core']['screen_name'],
-        "user_bio": user_results['legacy']['description'],  
-        # "user_id": user_results['id']
-
-        "retweeted_tweet": None,
-        "quoted_tweet": None,
-        "replying_to": None,
-        "post_image_description": None,
-        "post_video_description": None,
-    }
-    
-    if 'post_image_description' in result:
-        tweet["post_image_description"] = result['post_image_description']
-    if 'post_video_description' in result:
-        tweet["post_video_description"] = result['post_video_description']
-    if 'in_reply_to_screen_name' in legacy:
-        tweet["replying_to"] = legacy['in_reply_to_screen_name']
+        user_rest_id=user_results['rest_id'],
+        user_name=user_results['core']['name'],
+        user_screen_name=user_results['core']['screen_name'],
+        user_bio=user_results['legacy']['description'],  
+
+        post_image_description=result.get('post_image_description'),
+        post_video_description=result.get('post_video_description'),
+        replying_to=legacy.get('in_reply_to_screen_name'),
+    )
     
     if 'quoted_status_result' in result and result['quoted_status_result']:
         quoted_result = result['quoted_status_result']['result']
         if quoted_result['__typename'] == 'TweetWithVisibilityResults': quoted_result = quoted_result['tweet']
-        quoted_tweet = parse_tweet(quoted_result)
-        if not quoted_tweet:
-            tweet["quoted_tweet"] = quoted_tweet
+        tweet.quoted_tweet = parse_tweet(quoted_result)
     if 'retweeted_status_result' in legacy and legacy['retweeted_status_result']:
         retweeted_result = legacy['retweeted_status_result']['result']
         if retweeted_result['__typename'] == 'TweetWithVisibilityResults': retweeted_result = retweeted_result['tweet']
-        retweeted_tweet = parse_tweet(retweeted_result)
-        if not retweeted_tweet:
-            tweet["retweeted_tweet"] = retweeted_tweet
+        tweet.retweeted_tweet = parse_tweet(retweeted_result)
 
     return tweet
 
-def parse_entries(entries: list[dict], filter_retweets: bool = True) -> Tuple[List[Tweet], str]:
+SPAM_LABELS = ("Probable spam",) # TimelineLabel headers TweetDetail puts above the replies it ranks as spam
+
+def _is_spam_label(entry: dict) -> bool:
+    item_content = entry.get('content', {}).get('itemContent', {})
+    return item_content.get('itemType') == 'TimelineLabel' and item_content.get('text') in SPAM_LABELS
+
+def parse_entries(entries: list[dict], filter_retweets: bool = True, stop_at_spam: bool = False) -> Tuple[List[Tweet], str]:
+    """
+    Tweets and the bottom cursor of a timeline page.
+    stop_at_spam ends parsing at a "Probable spam" label: everything after it is spam, and so are the
+    later pages, so the cursor returned is empty.
+    """
     if len(entries) == 2 and (entries[0]['entryId'].startswith('cursor') and entries[-1]['entryId'].startswith('cursor')):
         return [], ""
     elif not entries[-1]['entryId'].startswith('cursor'): # cursor-showmorethreads or cursor-bottom 
@@ -72,6 +73,8 @@ def parse_entries(entries: list[dict], filter_retweets: bool = True) -> Tuple[Li
     
     for entry in entries[:-1]:
         entry_id = entry['entryId']
+        if stop_at_spam and entry_id.startswith('label') and _is_spam_label(entry):
+            return tweets, ""
         if entry_id.startswith('profile-conversation'):
             items = entry['content']['items']
             for item in items:
@@ -107,131 +110,281 @@ def parse_entries(entries: list[dict], filter_retweets: bool = True) -> Tuple[Li
             # print(result['__typename'])
             continue
         tweet = parse_tweet(result)
-        if filter_retweets and tweet['retweeted_tweet']: continue
         if not tweet: continue
+        if filter_retweets and tweet.retweeted_tweet: continue
         tweets.append(tweet)   
     return tweets, cursor_bottom
 
-def get_user_tweets(user_id: Union[str, int], minimum_tweets: int = -1, period: str = "all", cursor: Optional[str] = "", filter_retweets: bool = True) -> tuple[list[Tweet], str]:
+def timeline_positions(entries: list[dict]) -> List[int]:
     """
-    Fetch tweets from a user with pagination support. Minimum tweets takes precedence over period.
+    The ids a UserTweets page is ordered by, one per top-level item: a tweet entry's id, or the newest tweet of a
+    profile-conversation module. A self-thread sits where its latest tweet is and brings its older tweets along.
     """
-    print("Getting tweets for user_id: ", user_id)
-    cutoff_date = None
-    user_tweets_url = "https://x.com/i/api/graphql/VfoNveT-zJPGVZMPydZUfQ/UserTweets"
-    user_tweets_path = urlparse(url=user_tweets_url).path
-    headers['x-client-transaction-id'] = ct.generate_transaction_id(method="GET", path=user_tweets_path)
-    tweets = []
+    positions = []
+    for entry in entries:
+        entry_id = entry['entryId']
+        if entry_id.startswith('tweet-'):
+            positions.append(int(entry_id.rsplit('-', 1)[-1]))
+        elif entry_id.startswith('profile-conversation'):
+            ids = []
+            for item in entry['content']['items']:
+                result = (item['item']['itemContent'].get('tweet_results') or {}).get('result', {})
+                result = result.get('tweet', result) # TweetWithVisibilityResults
+                if 'rest_id' in result: ids.append(int(result['rest_id']))
+            if ids: positions.append(max(ids))
+    return positions
 
-    if period != "all":
-        for p in period.split(' '):
-            metric, value = p.split('=')
-            days = 0
-            if metric == 'day':
-                days += int(value)
-            elif metric == 'week':
-                days += int(value) * 7
-            elif metric == 'month':
-                days+= int(value) * 31
-            elif metric == 'year':
-                days += int(value) * 365
-        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-    
+USER_TWEETS_URL = "https://x.com/i/api/graphql/VfoNveT-zJPGVZMPydZUfQ/UserTweets"
+TWEET_DETAIL_URL = "https://x.com/i/api/graphql/ebRcCTtibrqIeEL92E34eg/TweetDetail"
+SEARCH_TIMELINE_URL = "https://x.com/i/api/graphql/7fWgap3nJOk9UpFV7UqcoQ/SearchTimeline"
+FEATURES = '{"rweb_video_screen_enabled":false,"payments_enabled":false,"profile_label_improvements_pcf_label_in_post_enabled":true,"rweb_tipjar_consumption_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"premium_content_api_read_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"responsive_web_grok_analyze_button_fetch_trends_enabled":false,"responsive_web_grok_analyze_post_followups_enabled":true,"responsive_web_jetfuel_frame":true,"responsive_web_grok_share_attachment_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"responsive_web_grok_show_grok_translated_post":true,"responsive_web_grok_analysis_button_from_backend":true,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_grok_image_annotation_enabled":true,"responsive_web_grok_imagine_annotation_enabled":true,"responsive_web_grok_community_note_auto_translation_is_enabled":false,"responsive_web_enhance_cards_enabled":false}'
+USER_TWEETS_FIELD_TOGGLES = '{"withArticlePlainText":false}'
+TWEET_DETAIL_FIELD_TOGGLES = '{"withArticleRichContentState":true,"withArticlePlainText":false,"withGrokAnalyze":false,"withDisallowedReplyControls":false}'
+
+MAX_CONCURRENT_REQUESTS = 8 # cap on requests in flight, across every thread and event loop of the process
+# blocking wrappers called from a thread pool each run their own loop, so the cap is a thread semaphore and not
+# an asyncio one; loops that have to wait for it block in their own executor, never in the default one
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+_request_slot_waiters = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="request-slot")
+
+def set_max_concurrency(max_concurrent_requests: int):
+    "Change the cap on requests in flight. Requests already in flight finish under the old cap."
+    global MAX_CONCURRENT_REQUESTS, _request_slots
+    MAX_CONCURRENT_REQUESTS = max(1, int(max_concurrent_requests))
+    _request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+@contextlib.asynccontextmanager
+async def _request_slot() -> AsyncIterator[None]:
+    "Hold one of the MAX_CONCURRENT_REQUESTS slots of the process"
+    slots = _request_slots
+    if not slots.acquire(blocking=False):
+        waiter = asyncio.get_running_loop().run_in_executor(_request_slot_waiters, slots.acquire)
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            waiter.add_done_callback(lambda _: slots.release()) # the slot is still taken once the thread gets it
+            raise
+    try:
+        yield
+    finally:
+        slots.release()
+
+async def _fetch(url: str, variables: Dict[str, Any], field_toggles: Optional[str] = None) -> dict:
+    "GET a GraphQL endpoint and return the decoded json body"
+    params = {
+        'variables': json.dumps(variables, separators=(',', ':')),
+        'features': FEATURES,
+    }
+    if field_toggles:
+        params['fieldToggles'] = field_toggles
+    endpoint = urlparse(url=url).path.rsplit('/', 1)[-1] # UserTweets, TweetDetail, SearchTimeline
+
+    cached = response_cache.get(endpoint, variables)
+    if cached is not None:
+        return cached
+
+    rate_limited = 0
+    transaction_retried = False
     while True:
-        params = {
-            'variables': '{"userId":"' + str(user_id) + '","count":20,"cursor":"' + cursor + '","includePromotedContent":false,"withQuickPromoteEligibilityTweetFields":false,"withVoice":true}',
-            'features': '{"rweb_video_screen_enabled":false,"payments_enabled":false,"profile_label_improvements_pcf_label_in_post_enabled":true,"rweb_tipjar_consumption_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"premium_content_api_read_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"responsive_web_grok_analyze_button_fetch_trends_enabled":false,"responsive_web_grok_analyze_post_followups_enabled":true,"responsive_web_jetfuel_frame":true,"responsive_web_grok_share_attachment_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"responsive_web_grok_show_grok_translated_post":true,"responsive_web_grok_analysis_button_from_backend":true,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_grok_image_annotation_enabled":true,"responsive_web_grok_imagine_annotation_enabled":true,"responsive_web_grok_community_note_auto_translation_is_enabled":false,"responsive_web_enhance_cards_enabled":false}',
-            'fieldToggles': '{"withArticlePlainText":false}',
-        }
-        response = client.get(
-            user_tweets_url + "?" + urlencode(params),
-            cookies=cookies,
-            headers=headers,
-        )
+        session = await session_pool.acquire(endpoint) # the account with the most budget left for this endpoint
+        sent_at = time.time()
+        async with _request_slot():
+            response = await session.get(url, params)
+        record_request(endpoint)
+        session.rate_limiter.update(endpoint, response.headers)
+        if response.status in TRANSACTION_ERRORS and not transaction_retried:
+            # rebuild the transaction id generator from fresh material and retry once before blaming the account
+            session.transaction.invalidate(before=sent_at)
+            transaction_retried = True
+            continue
+        if response.status in AUTH_ERRORS:
+            session_pool.retire(session, f"{response.status} on {endpoint}")
+            continue # the pool raises once every session is retired
+        if response.status == 429:
+            # despite pacing our budget was stale, try another session or wait for the reset, once per session
+            session.rate_limiter.exhaust(endpoint, response.headers)
+            rate_limited += 1
+            if rate_limited <= len(session_pool.sessions): continue
         if response.status != 200:
-            raise Exception(f"{response.status_code} : {response.text()}")
-        
-        entries = [instruction['entries'] for instruction in response.json()['data']['user']['result']['timeline']['timeline']['instructions'] if instruction['type'] == 'TimelineAddEntries'][0]
-        
-        if not entries:
-            # print(f"No entries found for {user_id} {cursor}")
-            break
-        
-        parsed_tweets, cursor = parse_entries(entries, filter_retweets=filter_retweets)
-        tweets.extend(parsed_tweets)
-        
-        if minimum_tweets != -1 and len(tweets) >= minimum_tweets: break
-        if cutoff_date and len(parsed_tweets) != 0:
-            # e.g. "Sat Dec 21 15:23:55 +0000 2024"
-            date_of_last_tweet = datetime.datetime.strptime(parsed_tweets[-1]["created_at"], "%a %b %d %H:%M:%S %z %Y").replace(tzinfo=None)
-            if date_of_last_tweet < cutoff_date:
+            raise Exception(f"{response.status} : {await response.text()}")
+        body = await response.bytes()
+        response_cache.put(endpoint, variables, body)
+        return json.loads(body)
+
+async def apaginate(fetch_page: Callable[[str], Awaitable[Tuple[list, str]]], cursor: Optional[str] = "") -> AsyncIterator[Tuple[list, str]]:
+    """Async paginator: yields (items, next_cursor) for each page until the cursor runs out.
+    fetch_page takes a cursor and returns (items, next_cursor).
+    """
+    while True:
+        items, cursor = await fetch_page(cursor)
+        yield items, cursor
+        if not cursor: break
+
+async def afetch_user_tweets_entries(user_id: Union[str, int], cursor: Optional[str] = "") -> List[dict]:
+    "Fetch the timeline entries of a single UserTweets page"
+    variables = {"userId": str(user_id), "count": 20, "cursor": cursor or "", "includePromotedContent": False, "withQuickPromoteEligibilityTweetFields": False, "withVoice": True}
+    data = await _fetch(USER_TWEETS_URL, variables, USER_TWEETS_FIELD_TOGGLES)
+    instructions = data['data']['user']['result']['timeline']['timeline']['instructions']
+    return next((instruction['entries'] for instruction in instructions if instruction['type'] == 'TimelineAddEntries'), [])
+
+async def afetch_user_tweets_page(user_id: Union[str, int], cursor: Optional[str] = "", filter_retweets: bool = True) -> Tuple[List[Tweet], str]:
+    "Fetch a single UserTweets page"
+    entries = await afetch_user_tweets_entries(user_id, cursor)
+    if not entries:
+        return [], ""
+    return parse_entries(entries, filter_retweets=filter_retweets)
+
+async def afetch_comments_page(tweet_id: Union[str, int], ranking_mode: str = "Relevance", cursor: Optional[str] = "", stop_at_spam: bool = False) -> Tuple[List[Tweet], str]:
+    "Fetch a single TweetDetail page, see parse_entries for stop_at_spam"
+    variables = {"focalTweetId": str(tweet_id), "with_rux_injections": False, "rankingMode": ranking_mode, "includePromotedContent": False, "withCommunity": True, "withQuickPromoteEligibilityTweetFields": False, "withBirdwatchNotes": True, "withVoice": True, "cursor": cursor or ""}
+    data = await _fetch(TWEET_DETAIL_URL, variables, TWEET_DETAIL_FIELD_TOGGLES)
+    instructions = data['data']['threaded_conversation_with_injections_v2']['instructions']
+    entries = next((instruction['entries'] for instruction in instructions if instruction['type'] == 'TimelineAddEntries'), [])
+    if not entries:
+        return [], ""
+    return parse_entries(entries, stop_at_spam=stop_at_spam)
+
+async def aiter_user_tweets(user_id: Union[str, int], minimum_tweets: int = -1, period: str = "all", cursor: Optional[str] = "", filter_retweets: bool = True) -> AsyncIterator[Tuple[List[Tweet], str]]:
+    """
+    Yield a user's tweets page by page as (tweets, resume_cursor). Stops on the same rules as get_user_tweets:
+    once minimum_tweets have been yielded or the period cutoff is passed. Minimum tweets takes precedence over period.
+    """
+    print("Getting tweets for user_id: ", user_id)
+    cutoff_id = period_cutoff_id(period) # tweet ids are snowflakes, so the cutoff is an id comparison
+    count = 0
+
+    async for parsed_tweets, cursor in apaginate(lambda c: afetch_user_tweets_page(user_id, c, filter_retweets), cursor):
+        count += len(parsed_tweets)
+        stop = minimum_tweets != -1 and count >= minimum_tweets
+        if not stop and cutoff_id and len(parsed_tweets) != 0:
+            if int(parsed_tweets[-1].tweet_id) < cutoff_id:
                 cursor = ''
+                stop = True
+        yield parsed_tweets, cursor
+        if stop: break
 
-        if cursor == "": break
+async def aiter_comments(tweet_id: Union[str, int], minimum_comments: int = 1, ranking_mode: str = "Relevance", cursor: Optional[str] = "", exclude_focal: bool = False, stop_at_spam: bool = False) -> AsyncIterator[Tuple[List[Tweet], str]]:
+    """
+    Yield the comments for a tweet page by page as (comments, resume_cursor) until minimum_comments have been yielded.
+    exclude_focal drops the tweet itself, which TweetDetail returns at the top of the first page.
+    stop_at_spam stops at the replies Twitter labels as probable spam.
+    """
+    tweet_id = str(tweet_id)
+    count = 0
+    async for parsed_comments, cursor in apaginate(lambda c: afetch_comments_page(tweet_id, ranking_mode, c, stop_at_spam), cursor):
+        if exclude_focal:
+            parsed_comments = [comment for comment in parsed_comments if comment.tweet_id != tweet_id]
+        count += len(parsed_comments)
+        yield parsed_comments, cursor
+        if count >= minimum_comments: break
 
-    return tweets, cursor
+async def aget_user_tweets(user_id: Union[str, int], minimum_tweets: int = -1, period: str = "all", cursor: Optional[str] = "", filter_retweets: bool = True) -> tuple[list[Tweet], str]:
+    """
+    Fetch tweets from a user with pagination support. Minimum tweets takes precedence over period.
+    """
+    tweets = []
+    async for parsed_tweets, cursor in aiter_user_tweets(user_id, minimum_tweets=minimum_tweets, period=period, cursor=cursor, filter_retweets=filter_retweets):
+        tweets.extend(parsed_tweets)
+    return sort_newest_first(tweets), cursor
 
-def get_comments(tweet_id: Union[str, int], minimum_comments: int = 1, ranking_mode: str = "Relevance", cursor: Optional[str] = "") -> tuple[list["Tweet"], str]:
+async def aget_comments(tweet_id: Union[str, int], minimum_comments: int = 1, ranking_mode: str = "Relevance", cursor: Optional[str] = "", exclude_focal: bool = False, stop_at_spam: bool = False) -> tuple[list["Tweet"], str]:
     """Get the comments for a tweet
     Args:
         tweet_id: The ID of the tweet to get the comments for
         cursor: The cursor to get the next page of comments or empty string if it is the last page
+        exclude_focal: drop the tweet itself from the comments
+        stop_at_spam: stop at the replies Twitter labels as probable spam
     Returns:
-        a json string of the comments and the cursor to get the next page of comments
+        the comments and the cursor to get the next page of comments
     """
-    tweet_id = str(tweet_id)
     comments = []
-    while True:
-        params = {
-        'variables': '{"focalTweetId":"' + tweet_id + '","with_rux_injections":false,"rankingMode":"' + ranking_mode + '","includePromotedContent":false,"withCommunity":true,"withQuickPromoteEligibilityTweetFields":false,"withBirdwatchNotes":true,"withVoice":true,"cursor":"' + cursor + '"}',
-        'features': '{"rweb_video_screen_enabled":false,"payments_enabled":false,"profile_label_improvements_pcf_label_in_post_enabled":true,"rweb_tipjar_consumption_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"premium_content_api_read_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"responsive_web_grok_analyze_button_fetch_trends_enabled":false,"responsive_web_grok_analyze_post_followups_enabled":true,"responsive_web_jetfuel_frame":true,"responsive_web_grok_share_attachment_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"responsive_web_grok_show_grok_translated_post":true,"responsive_web_grok_analysis_button_from_backend":true,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_grok_image_annotation_enabled":true,"responsive_web_grok_imagine_annotation_enabled":true,"responsive_web_grok_community_note_auto_translation_is_enabled":false,"responsive_web_enhance_cards_enabled":false}',
-        'fieldToggles': '{"withArticleRichContentState":true,"withArticlePlainText":false,"withGrokAnalyze":false,"withDisallowedReplyControls":false}',
-        }
-
-        tweet_detail_url = "https://x.com/i/api/graphql/ebRcCTtibrqIeEL92E34eg/TweetDetail"
-        tweet_detail_path = urlparse(url=tweet_detail_url).path
-        
-        headers['x-client-transaction-id'] = ct.generate_transaction_id(method="GET", path=tweet_detail_path)
-        response = client.get(
-            tweet_detail_url + "?" + urlencode(params),
-            cookies=cookies,
-            headers=headers,
-        )
-        if response.status != 200: 
-            raise Exception(f"{response.status_code} : {response.text}")
-        instructions = response.json()['data']['threaded_conversation_with_injections_v2']['instructions']
-        entries = []
-        for instruction in instructions:
-            if instruction['type'] == 'TimelineAddEntries':
-                entries = instruction['entries']
-                break
-
-        if len(comments) >= minimum_comments: break
-        parsed_comments, cursor = parse_entries(entries)
+    async for parsed_comments, cursor in aiter_comments(tweet_id, minimum_comments=minimum_comments, ranking_mode=ranking_mode, cursor=cursor, exclude_focal=exclude_focal, stop_at_spam=stop_at_spam):
         comments.extend(parsed_comments)
-        if cursor == "": break
     return comments, cursor
-    
-def search_people(query: str, cursor: Optional[str] = "") -> Tuple[Dict[str, Any], str]:
-    query = query.replace('"', '')
-    params = {
-    'variables': '{"rawQuery":"' + query + '","count":100,"cursor":"' + cursor + '","querySource":"","product":"People","withGrokTranslatedBio":false}',
-    'features': '{"rweb_video_screen_enabled":false,"payments_enabled":false,"profile_label_improvements_pcf_label_in_post_enabled":true,"rweb_tipjar_consumption_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"premium_content_api_read_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"responsive_web_grok_analyze_button_fetch_trends_enabled":false,"responsive_web_grok_analyze_post_followups_enabled":true,"responsive_web_jetfuel_frame":true,"responsive_web_grok_share_attachment_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"responsive_web_grok_show_grok_translated_post":true,"responsive_web_grok_analysis_button_from_backend":true,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_grok_image_annotation_enabled":true,"responsive_web_grok_imagine_annotation_enabled":true,"responsive_web_grok_community_note_auto_translation_is_enabled":false,"responsive_web_enhance_cards_enabled":false}',
-    }
-    
-    search_timeline_url = "https://x.com/i/api/graphql/7fWgap3nJOk9UpFV7UqcoQ/SearchTimeline"
-    search_timeline_path = urlparse(url=search_timeline_url).path
-    headers['x-client-transaction-id'] = ct.generate_transaction_id(method="GET", path=search_timeline_path)
 
-    response = client.get(
-        search_timeline_url + "?" + urlencode(params),
-        cookies=cookies, headers=headers,
-    )
+async def arefresh_user_tweets(user_id: Union[str, int], minimum_tweets: int = -1, period: str = "all", max_pages: int = -1) -> List[Tweet]:
+    """
+    Incremental get_user_tweets backed by tweet_store (retweets filtered).
+    Pages from the top only until it reaches tweets stored by an earlier run, merges the new ones into
+    the stored history, and pages further back only if that history does not cover minimum_tweets/period yet.
+    max_pages caps the UserTweets requests (e.g. a RequestScheduler grant), -1 for no cap.
+    Returns the tweets within the period, newest first, capped at minimum_tweets.
+    """
+    user_id = str(user_id)
+    cutoff_id = period_cutoff_id(period)
+    watermark = tweet_store.watermark(user_id)
+    known_id = watermark["newest_id"] if watermark else 0
+    pages = 0
+
+    def covered(count: int, oldest: Optional[Tweet], cursor: str) -> bool:
+        if not cursor: return True # reached the end of the timeline
+        if minimum_tweets != -1 and count >= minimum_tweets: return True
+        return cutoff_id is not None and oldest is not None and int(oldest.tweet_id) < cutoff_id
+
+    def out_of_pages() -> bool:
+        return max_pages != -1 and pages >= max_pages
+
+    async def fetch_page(cursor: str) -> Tuple[Tuple[List[Tweet], List[int]], str]:
+        entries = await afetch_user_tweets_entries(user_id, cursor)
+        if not entries:
+            return ([], []), ""
+        tweets, cursor = parse_entries(entries)
+        return (tweets, timeline_positions(entries)), cursor
 
+    def selected(history: List[Tweet]) -> List[Tweet]:
+        if cutoff_id:
+            history = [tweet for tweet in history if int(tweet.tweet_id) >= cutoff_id]
+        return history[:minimum_tweets] if minimum_tweets != -1 else history
 
-    if response.status != 200: 
-        raise Exception(f"{response.status_code} : {response.text}")
-    entries = response.json()['data']['search_by_raw_query']['search_timeline']['timeline']['instructions'][-1]['entries']
+    if out_of_pages(): # no UserTweets requests granted, serve the stored history
+        return selected(tweet_store.load(user_id, min_id=watermark["oldest_id"])) if watermark else []
+
+    # 1. new tweets, from the top down to the watermark
+    fresh, cursor, reached = [], "", False
+    async for (parsed_tweets, positions), cursor in apaginate(fetch_page, ""):
+        pages += 1
+        fresh.extend(tweet for tweet in parsed_tweets if int(tweet.tweet_id) > known_id)
+        # judged on the top-level items only: a conversation module can bring stored tweets above newer ones
+        if watermark and any(position <= known_id for position in positions):
+            reached = True
+            break
+        if covered(len(fresh), fresh[-1] if fresh else None, cursor) or out_of_pages(): break
+
+    if reached or (watermark and not fresh):
+        oldest_id, oldest_cursor = watermark["oldest_id"], watermark["oldest_cursor"]
+    elif fresh:
+        # first run, or too much is new to bridge the gap to the stored history: start a new contiguous history
+        oldest_id, oldest_cursor = min(int(tweet.tweet_id) for tweet in fresh), cursor
+    else:
+        return []
+    newest_id = max([known_id] + [int(tweet.tweet_id) for tweet in fresh])
+    tweet_store.save(user_id, fresh, newest_id, oldest_id, oldest_cursor)
+    history = tweet_store.load(user_id, min_id=oldest_id)
+    print(f"Refreshed tweets for user_id: {user_id}, {len(fresh)} new, {len(history)} stored")
+
+    # 2. backfill if the stored history is not deep enough yet
+    if not covered(len(history), history[-1] if history else None, oldest_cursor) and not out_of_pages():
+        older = []
+        async for parsed_tweets, oldest_cursor in apaginate(lambda c: afetch_user_tweets_page(user_id, c), oldest_cursor):
+            pages += 1
+            older.extend(parsed_tweets)
+            if covered(len(history) + len(older), older[-1] if older else None, oldest_cursor) or out_of_pages(): break
+        if older:
+            oldest_id = min(oldest_id, min(int(tweet.tweet_id) for tweet in older))
+        tweet_store.save(user_id, older, newest_id, oldest_id, oldest_cursor)
+        history = tweet_store.load(user_id, min_id=oldest_id)
+
+    return selected(history)
+
+async def asearch_people(query: str, cursor: Optional[str] = "") -> Tuple[List[Dict[str, Any]], str]:
+    query = query.replace('"', '')
+    variables = {"rawQuery": query, "count": 100, "cursor": cursor or "", "querySource": "", "product": "People", "withGrokTranslatedBio": False}
+    data = await _fetch(SEARCH_TIMELINE_URL, variables)
+    entries = data['data']['search_by_raw_query']['search_timeline']['timeline']['instructions'][-1]['entries']
+    return parse_users(entries)
+
+def parse_users(entries: list[dict]) -> Tuple[List[Dict[str, Any]], str]:
+    "Users and the bottom cursor of a People search page"
     cursor_bottom = entries[-1]['content']['value']
     users = []
     for entry in entries:
@@ -273,34 +426,122 @@ def search_people(query: str, cursor: Optional[str] = "") -> Tuple[Dict[str, Any
         })
     return users, cursor_bottom
 
-def search_tweets(query: str, latest: bool = True, cursor: Optional[str] = "") -> Tuple[List[Tweet], str]:
-    params = {
-    'variables': '{"rawQuery":"' + query + ' min_replies:10 -filter:replies","count":20,"querySource":"typed_query","product":"' + ("Latest" if latest else "Top") + '","withGrokTranslatedBio":false}',
-    'features': '{"rweb_video_screen_enabled":false,"payments_enabled":false,"profile_label_improvements_pcf_label_in_post_enabled":true,"rweb_tipjar_consumption_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"premium_content_api_read_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"responsive_web_grok_analyze_button_fetch_trends_enabled":false,"responsive_web_grok_analyze_post_followups_enabled":true,"responsive_web_jetfuel_frame":true,"responsive_web_grok_share_attachment_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"responsive_web_grok_show_grok_translated_post":true,"responsive_web_grok_analysis_button_from_backend":true,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_grok_image_annotation_enabled":true,"responsive_web_grok_imagine_annotation_enabled":true,"responsive_web_grok_community_note_auto_translation_is_enabled":false,"responsive_web_enhance_cards_enabled":false}',
-    }
-    
-    search_timeline_url = "https://x.com/i/api/graphql/7fWgap3nJOk9UpFV7UqcoQ/SearchTimeline"
-    search_timeline_path = urlparse(url=search_timeline_url).path
-    headers['x-client-transaction-id'] = ct.generate_transaction_id(method="GET", path=search_timeline_path)
-
-    response = client.get(
-        search_timeline_url + "?" + urlencode(params),
-        cookies=cookies,
-        headers=headers,
-    )
-    if response.status != 200: 
-        raise Exception(f"{response.status_code} : {response.text}")
-    entries = response.json()['data']['search_by_raw_query']['search_timeline']['timeline']['instructions'][0]['entries']
+async def asearch_tweets(query: str, latest: bool = True, cursor: Optional[str] = "") -> Tuple[List[Tweet], str]:
+    variables = {"rawQuery": query + " min_replies:10 -filter:replies", "count": 20, "querySource": "typed_query", "product": "Latest" if latest else "Top", "withGrokTranslatedBio": False}
+    if cursor:
+        variables["cursor"] = cursor
+    data = await _fetch(SEARCH_TIMELINE_URL, variables)
+    entries = data['data']['search_by_raw_query']['search_timeline']['timeline']['instructions'][0]['entries']
     return parse_entries(entries)
 
-client = rnet.BlockingClient(impersonate=rnet.Impersonate.Firefox139)
-headers, cookies = load_secrets()
-ct = create_client_transaction(client, headers)
+async def aget_user_tweets_many(user_ids: Iterable[Union[str, int]], **kwargs) -> Dict[str, Tuple[List[Tweet], str]]:
+    "aget_user_tweets for several users at once, bounded by MAX_CONCURRENT_REQUESTS"
+    user_ids = [str(user_id) for user_id in user_ids]
+    results = await asyncio.gather(*(aget_user_tweets(user_id, **kwargs) for user_id in user_ids))
+    return dict(zip(user_ids, results))
 
+async def aget_comments_many(tweet_ids: Iterable[Union[str, int]], **kwargs) -> Dict[str, Tuple[List[Tweet], str]]:
+    "aget_comments for several tweets at once, bounded by MAX_CONCURRENT_REQUESTS"
+    tweet_ids = [str(tweet_id) for tweet_id in tweet_ids]
+    results = await asyncio.gather(*(aget_comments(tweet_id, **kwargs) for tweet_id in tweet_ids))
+    return dict(zip(tweet_ids, results))
 
+async def afetch_comments_pages(cursors: Dict[str, str], ranking_mode: str = "Relevance", exclude_focal: bool = False, stop_at_spam: bool = False) -> Dict[str, Tuple[List[Tweet], str]]:
+    """
+    The next comments page of several tweets at once: {tweet_id: cursor} ("" for the first page) -> {tweet_id: (comments, next_cursor)}.
+    An empty next_cursor means the tweet has no more comments. For callers that decide page by page which tweets to continue.
+    """
+    async def fetch(tweet_id: str, cursor: str) -> Tuple[List[Tweet], str]:
+        comments, next_cursor = await afetch_comments_page(tweet_id, ranking_mode, cursor, stop_at_spam)
+        if exclude_focal:
+            comments = [comment for comment in comments if comment.tweet_id != tweet_id]
+        return comments, next_cursor
+    tweet_ids = [str(tweet_id) for tweet_id in cursors]
+    results = await asyncio.gather(*(fetch(tweet_id, cursor) for tweet_id, cursor in zip(tweet_ids, cursors.values())))
+    return dict(zip(tweet_ids, results))
 
+def _run(coro: Awaitable):
+    "Run a coroutine from blocking code, also when the caller already sits inside an event loop (e.g. a notebook)"
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # in the caller's context, so e.g. RequestScheduler.track still sees the requests
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coro).result()
 
+def _run_on(loop: asyncio.AbstractEventLoop, coro: Awaitable):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return loop.run_until_complete(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, loop.run_until_complete, coro).result()
+
+def _iterate(agen: AsyncIterator):
+    "Drive an async generator from blocking code, one item per next()"
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                item = _run_on(loop, agen.__anext__())
+            except StopAsyncIteration:
+                break
+            yield item
+    finally:
+        _run_on(loop, agen.aclose())
+        loop.close()
+
+def iter_user_tweets(user_id: Union[str, int], minimum_tweets: int = -1, period: str = "all", cursor: Optional[str] = "", filter_retweets: bool = True) -> Iterator[Tuple[List[Tweet], str]]:
+    """
+    Yield a user's tweets page by page as (tweets, resume_cursor), see aiter_user_tweets.
+    Wrap in utils.prefetch to fetch the next page while the current one is being processed.
+    """
+    return _iterate(aiter_user_tweets(user_id, minimum_tweets=minimum_tweets, period=period, cursor=cursor, filter_retweets=filter_retweets))
 
+def iter_comments(tweet_id: Union[str, int], minimum_comments: int = 1, ranking_mode: str = "Relevance", cursor: Optional[str] = "", exclude_focal: bool = False, stop_at_spam: bool = False) -> Iterator[Tuple[List[Tweet], str]]:
+    """
+    Yield the comments for a tweet page by page as (comments, resume_cursor), see aiter_comments.
+    Wrap in utils.prefetch to fetch the next page while the current one is being processed.
+    """
+    return _iterate(aiter_comments(tweet_id, minimum_comments=minimum_comments, ranking_mode=ranking_mode, cursor=cursor, exclude_focal=exclude_focal, stop_at_spam=stop_at_spam))
 
+def get_user_tweets(user_id: Union[str, int], minimum_tweets: int = -1, period: str = "all", cursor: Optional[str] = "", filter_retweets: bool = True) -> tuple[list[Tweet], str]:
+    """
+    Fetch tweets from a user with pagination support. Minimum tweets takes precedence over period.
+    """
+    return _run(aget_user_tweets(user_id, minimum_tweets=minimum_tweets, period=period, cursor=cursor, filter_retweets=filter_retweets))
 
+def get_comments(tweet_id: Union[str, int], minimum_comments: int = 1, ranking_mode: str = "Relevance", cursor: Optional[str] = "", exclude_focal: bool = False, stop_at_spam: bool = False) -> tuple[list["Tweet"], str]:
+    """Get the comments for a tweet
+    Args:
+        tweet_id: The ID of the tweet to get the comments for
+        cursor: The cursor to get the next page of comments or empty string if it is the last page
+        exclude_focal: drop the tweet itself from the comments
+        stop_at_spam: stop at the replies Twitter labels as probable spam
+    Returns:
+        the comments and the cursor to get the next page of comments
+    """
+    return _run(aget_comments(tweet_id, minimum_comments=minimum_comments, ranking_mode=ranking_mode, cursor=cursor, exclude_focal=exclude_focal, stop_at_spam=stop_at_spam))
+
+def get_comments_many(tweet_ids: Iterable[Union[str, int]], **kwargs) -> Dict[str, Tuple[List[Tweet], str]]:
+    return _run(aget_comments_many(tweet_ids, **kwargs))
+
+def fetch_comments_pages(cursors: Dict[str, str], **kwargs) -> Dict[str, Tuple[List[Tweet], str]]:
+    return _run(afetch_comments_pages(cursors, **kwargs))
+
+def refresh_user_tweets(user_id: Union[str, int], minimum_tweets: int = -1, period: str = "all", max_pages: int = -1) -> List[Tweet]:
+    """
+    Incremental get_user_tweets: only fetches what is newer than the locally stored history, see arefresh_user_tweets.
+    """
+    return _run(arefresh_user_tweets(user_id, minimum_tweets=minimum_tweets, period=period, max_pages=max_pages))
+
+def search_people(query: str, cursor: Optional[str] = "") -> Tuple[List[Dict[str, Any]], str]:
+    return _run(asearch_people(query, cursor=cursor))
+
+def search_tweets(query: str, latest: bool = True, cursor: Optional[str] = "") -> Tuple[List[Tweet], str]:
+    return _run(asearch_tweets(query, latest=latest, cursor=cursor))
 
+tweet_store = TweetStore()
+response_cache = ResponseCache(mode=os.environ.get("TWITTER_CACHE_MODE", "readwrite")) # "off" | "readwrite" | "replay"
+session_pool = SessionPool.from_secrets() # one session per account in secrets.json, each with its own client and rate budget
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+from typing import Optional, Dict, Any, List
+from urllib.parse import urlencode, urlparse
+
+import rnet
+
+from .ratelimit import RateLimiter, POLL_INTERVAL
+from .transaction import LazyClientTransaction
+from .utils import load_sessions
+
+AUTH_ERRORS = (401, 403)
+TRANSACTION_ERRORS = (403, 404) # also how x.com answers transaction ids derived from outdated homepage material
+
+class ScraperSession:
+    """
+    One logged-in X account: its own client, copies of its headers/cookies, its transaction id generator
+    and its own per-endpoint rate limit budget. Nothing shared is mutated per request, so a session can be
+    used from several threads and event loops at once.
+    """
+    def __init__(self, headers: Dict[str, str], cookies: Dict[str, str], name: str = ""):
+        self.name = name
+        self.headers = dict(headers)
+        self.cookies = dict(cookies)
+        self.client = rnet.Client(impersonate=rnet.Impersonate.Firefox139)
+        # every session derives ids from the same on-disk homepage material, only the generator is per session
+        self.transaction = LazyClientTransaction(rnet.BlockingClient(impersonate=rnet.Impersonate.Firefox139), self.headers)
+        self.rate_limiter = RateLimiter()
+        self.retired = False
+        self.retired_reason = ""
+        self.requests = 0
+
+    def request_headers(self, method: str, path: str) -> Dict[str, str]:
+        "Headers for a single request: a fresh copy carrying its own x-client-transaction-id"
+        return {**self.headers, 'x-client-transaction-id': self.transaction.generate_transaction_id(method=method, path=path)}
+
+    async def get(self, url: str, params: Optional[Dict[str, str]] = None):
+        "GET url with this account's cookies and a new transaction id"
+        if not self.transaction.ready: # building the generator reads the cache file or fetches x.com, off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.transaction.get)
+        headers = self.request_headers("GET", urlparse(url).path)
+        return await self.client.get(url + "?" + urlencode(params) if params else url, cookies=self.cookies, headers=headers)
+
+    def __repr__(self) -> str:
+        return f"ScraperSession({self.name!r}{', retired' if self.retired else ''})"
+
+class SessionPool:
+    """
+    Hands out sessions per request: the live session with the most budget left for the endpoint gets the
+    next request, so pages of get_comments/get_user_tweets spread over all accounts and throughput scales
+    with the number of sessions. Sessions that fail authentication are retired.
+    """
+    def __init__(self, sessions: List[ScraperSession]):
+        self.sessions = sessions
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_secrets(cls) -> "SessionPool":
+        """
+        One session per account in secrets.json. Without the file the pool is empty and raises on the first
+        request, so offline use of the package (parsing, the archive, benchmarks) does not need credentials.
+        """
+        try:
+            sessions = load_sessions()
+        except FileNotFoundError:
+            sessions = []
+        return cls([ScraperSession(headers, cookies, name=f"session-{i}") for i, (headers, cookies) in enumerate(sessions)])
+
+    def __len__(self) -> int:
+        return len(self.live())
+
+    def live(self) -> List[ScraperSession]:
+        return [session for session in self.sessions if not session.retired]
+
+    def _live_or_raise(self) -> List[ScraperSession]:
+        live = self.live()
+        if not self.sessions:
+            raise Exception("No sessions, add an account to secrets.json")
+        if not live:
+            reasons = "; ".join(f"{session.name}: {session.retired_reason}" for session in self.sessions)
+            raise Exception(f"All sessions retired ({reasons})")
+        return live
+
+    def reserve(self, endpoint: str):
+        "Non-blocking: (session, 0) when a session had budget, otherwise (None, seconds until one should)"
+        with self._lock:
+            live = self._live_or_raise()
+            live.sort(key=lambda session: (-session.rate_limiter.budget(endpoint)["remaining"], session.requests))
+            wait = None
+            for session in live:
+                session_wait = session.rate_limiter.reserve(endpoint)
+                if session_wait == 0:
+                    session.requests += 1
+                    return session, 0.0
+                wait = session_wait if wait is None else min(wait, session_wait)
+            return None, wait
+
+    async def acquire(self, endpoint: str) -> ScraperSession:
+        "Wait for the session with the most budget left for the endpoint and take a token from it"
+        while True:
+            session, wait = self.reserve(endpoint)
+            if session is not None:
+                return session
+            await asyncio.sleep(min(wait, POLL_INTERVAL))
+
+    def retire(self, session: ScraperSession, reason: str):
+        with self._lock:
+            if not session.retired:
+                print(f"Retiring {session.name}: {reason}")
+            session.retired = True
+            session.retired_reason = reason
+
+    def seconds_until_reset(self, endpoint: str, default: float = 60.0) -> float:
+        "Time until any live session has budget for the endpoint again, default when no session is live"
+        live = self.live()
+        if not live:
+            return default
+        return min(session.rate_limiter.seconds_until_reset(endpoint) for session in live)
+
+    def budget(self, endpoint: str) -> Dict[str, Any]:
+        "Budget for an endpoint summed over the live sessions: {'limit', 'remaining', 'reset_in', 'sessions'}"
+        budgets = [session.rate_limiter.budget(endpoint) for session in self.live()]
+        return {
+            "limit": sum(budget["limit"] for budget in budgets),
+            "remaining": sum(budget["remaining"] for budget in budgets),
+            "reset_in": min((budget["reset_in"] for budget in budgets), default=0.0),
+            "sessions": len(budgets),
+        }
+
+    def budgets(self) -> Dict[str, Dict[str, Any]]:
+        endpoints = set()
+        for session in self.live():
+            endpoints |= set(session.rate_limiter.default_limits) | set(session.rate_limiter.buckets)
+        return {endpoint: self.budget(endpoint) for endpoint in endpoints}
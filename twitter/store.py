@@ -0,0 +1,87 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Union, Iterable
+
+from .utils import Tweet
+
+STORE_PATH = Path(__file__).parent / ".cache" / "tweets.db"
+
+class TweetStore:
+    """
+    Local history of the tweets fetched per user, so a refresh only has to page back to the newest tweet we already have.
+    Per user it keeps:
+        newest_id: watermark, the newest tweet id stored
+        oldest_id: oldest tweet id of the contiguous history that ends at newest_id
+        oldest_cursor: UserTweets cursor to continue backwards from oldest_id ("" when the timeline was exhausted)
+    """
+    def __init__(self, path: Union[str, Path] = STORE_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS tweets (
+                    user_rest_id TEXT NOT NULL,
+                    tweet_id INTEGER NOT NULL,
+                    body TEXT NOT NULL,
+                    PRIMARY KEY (user_rest_id, tweet_id)
+                )""")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    user_rest_id TEXT PRIMARY KEY,
+                    newest_id INTEGER NOT NULL,
+                    oldest_id INTEGER NOT NULL,
+                    oldest_cursor TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+        return self._db
+
+    def watermark(self, user_id: Union[str, int]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT newest_id, oldest_id, oldest_cursor, updated_at FROM watermarks WHERE user_rest_id = ?", (str(user_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"newest_id": row[0], "oldest_id": row[1], "oldest_cursor": row[2], "updated_at": row[3]}
+
+    def save(self, user_id: Union[str, int], tweets: Iterable[Tweet], newest_id: int, oldest_id: int, oldest_cursor: str):
+        "Store tweets and move the user's watermark"
+        user_id = str(user_id)
+        rows = [(user_id, int(tweet.tweet_id), json.dumps(tweet.to_dict(), ensure_ascii=False)) for tweet in tweets]
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN")
+            try:
+                db.executemany("INSERT OR REPLACE INTO tweets (user_rest_id, tweet_id, body) VALUES (?, ?, ?)", rows)
+                db.execute("INSERT OR REPLACE INTO watermarks (user_rest_id, newest_id, oldest_id, oldest_cursor, updated_at) VALUES (?, ?, ?, ?, ?)",
+                           (user_id, newest_id, oldest_id, oldest_cursor or "", time.time()))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def load(self, user_id: Union[str, int], min_id: int = 0, max_id: Optional[int] = None) -> List[Tweet]:
+        "Stored tweets for a user with min_id <= tweet_id <= max_id, newest first"
+        query = "SELECT body FROM tweets WHERE user_rest_id = ? AND tweet_id >= ?"
+        params = [str(user_id), min_id]
+        if max_id is not None:
+            query += " AND tweet_id <= ?"
+            params.append(max_id)
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY tweet_id DESC", params).fetchall()
+        return [Tweet.from_dict(json.loads(row[0])) for row in rows]
+
+    def forget(self, user_id: Union[str, int]):
+        with self._lock:
+            db = self._connect()
+            db.execute("DELETE FROM tweets WHERE user_rest_id = ?", (str(user_id),))
+            db.execute("DELETE FROM watermarks WHERE user_rest_id = ?", (str(user_id),))
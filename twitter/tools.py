@@ -6,7 +6,7 @@ from .utils import tweets_to_json, tweets_to_table, users_to_json, users_to_tabl
 @tool
 def get_user_tweets_str(user_id: str, minimum_tweets: int = 0, period: str = "month=1", cursor: Optional[str] = "") -> str:
     """Fetch a user's tweets with pagination.
-    Input: user_id, minimum_tweets, period ("all"|"day"|"week"|"month"|"year"), cursor ("" first page; else prior).
+    Input: user_id, minimum_tweets, period ("all" or day/week/month/year tokens, e.g. "month=1 week=2"), cursor ("" first page; else prior).
     Output: first line "cursor: <next>" ("" if none); then pipe table:
     tweet_id|type|user|time|views|likes|retweets|quotes|replies|text|lang|user_bio|user_id|media|reply_to|ref
     """
@@ -29,7 +29,7 @@ def get_comments_str(tweet_id: str, minimum_comments: int = 0, cursor: Optional[
     Output: first line "cursor: <next>" ("" if none); then pipe table.
     """
     try:
-        comments, cursor = get_comments(tweet_id, cursor)
+        comments, cursor = get_comments(tweet_id, minimum_comments=minimum_comments, cursor=cursor)
         result = f"cursor: {cursor}\n{tweets_to_json(comments)}"
     except Exception as e:
         result = f"Error fetching comments for tweet ID: {tweet_id}: {str(e)}. You could probably be rate limited. Try again later."
@@ -56,7 +56,7 @@ def search_tweets_str(query: str, cursor: Optional[str] = "") -> str:
     Input: query, cursor ("" first page; else prior).
     Output: first token is next_cursor ("" if none); then pipe table (same schema as get_user_tweets).
     """
-    tweets, cursor_bottom = search_tweets(query, cursor)
+    tweets, cursor_bottom = search_tweets(query, cursor=cursor)
     if not tweets:
         return f"No tweets found for query: {query}. You could probably be rate limited. Try again later."
     
@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple, Union, Dict
+
+import bs4
+import x_client_transaction
+import zstandard
+
+TRANSACTION_CACHE_PATH = Path(__file__).parent / ".cache" / "transaction.json.zst"
+TRANSACTION_TTL = 12 * 60 * 60 # x.com rotates the homepage key/animation a few times a day at most
+TRANSACTION_RETRY = 5 * 60 # wait before trying again after a failed background refresh
+
+def fetch_transaction_material(client, headers) -> Tuple[str, str]:
+    "Fetch the x.com homepage and the ondemand.s file the transaction id is derived from"
+    response = client.get(url="https://x.com", headers=headers)
+    home_page = response.text()
+    ondemand_file_url = x_client_transaction.constants.ON_DEMAND_FILE_REGEX.search(home_page)
+    if not ondemand_file_url:
+        raise Exception("Could not find ondemand.s file")
+    ondemand_file_url = f"https://abs.twimg.com/responsive-web/client-web/ondemand.s.{ondemand_file_url.group(1)}a.js"
+    ondemand_file_response = client.get(url=ondemand_file_url, headers=headers)
+    return home_page, ondemand_file_response.text()
+
+def build_client_transaction(home_page: str, ondemand_file: str) -> x_client_transaction.ClientTransaction:
+    # ClientTransaction only reads the text of the ondemand file, no need to parse it as html
+    return x_client_transaction.ClientTransaction(home_page_response=bs4.BeautifulSoup(home_page, 'html.parser'), ondemand_file_response=ondemand_file)
+
+def create_client_transaction(client, headers) -> x_client_transaction.ClientTransaction:
+    "Create a client for generating a transaction-id"
+    return build_client_transaction(*fetch_transaction_material(client, headers))
+
+_material_locks: Dict[Path, threading.Lock] = {}
+_material_locks_lock = threading.Lock()
+
+def _material_lock(path: Path) -> threading.Lock:
+    "One lock per cache file, so the sessions sharing it fetch new material once between them"
+    with _material_locks_lock:
+        return _material_locks.setdefault(path.resolve(), threading.Lock())
+
+class LazyClientTransaction:
+    """
+    Stand-in for ClientTransaction that is only built on the first generate_transaction_id call.
+    The homepage/ondemand material is cached on disk: a fresh copy is used as is, a stale copy is
+    used while a background thread fetches a new one, and only a missing copy blocks on the network.
+    Staleness is checked on every call, so a long running process moves on to new material too.
+    Every session owns its generator, built with its own client and headers. Only the material is shared,
+    through the cache file: it is the public x.com homepage and ondemand.s file, the same for every account,
+    so a session that needs new material first takes what another session fetched since.
+    """
+    def __init__(self, client, headers, path: Union[str, Path] = TRANSACTION_CACHE_PATH, ttl: float = TRANSACTION_TTL):
+        self.client = client
+        self.headers = headers
+        self.path = Path(path)
+        self.ttl = ttl
+        self._ct: Optional[x_client_transaction.ClientTransaction] = None
+        self._fetched_at = 0.0 # when the material of _ct was fetched
+        self._next_check = 0.0 # when to refresh in the background
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _load(self) -> Optional[Tuple[str, str, float]]:
+        try:
+            material = json.loads(zstandard.ZstdDecompressor().decompress(self.path.read_bytes()))
+            return material["home_page"], material["ondemand_file"], material["fetched_at"]
+        except (OSError, ValueError, KeyError, zstandard.ZstdError):
+            return None
+
+    def _save(self, home_page: str, ondemand_file: str):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        body = json.dumps({"home_page": home_page, "ondemand_file": ondemand_file, "fetched_at": time.time()})
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_bytes(zstandard.ZstdCompressor().compress(body.encode()))
+        tmp.replace(self.path)
+
+    def _fetch(self) -> x_client_transaction.ClientTransaction:
+        home_page, ondemand_file = fetch_transaction_material(self.client, self.headers)
+        ct = build_client_transaction(home_page, ondemand_file)
+        self._save(home_page, ondemand_file)
+        return ct
+
+    def _cached(self, newer_than: float = 0.0) -> Optional[Tuple[x_client_transaction.ClientTransaction, float]]:
+        "(generator, fetched_at) from the cache file, if it holds material fetched after newer_than"
+        cached = self._load()
+        if cached is None or cached[2] <= newer_than:
+            return None
+        home_page, ondemand_file, fetched_at = cached
+        try:
+            return build_client_transaction(home_page, ondemand_file), fetched_at
+        except Exception:
+            return None # cached material no longer parses
+
+    def _fresh(self, newer_than: float = 0.0) -> Tuple[x_client_transaction.ClientTransaction, float]:
+        "Material fetched after newer_than: another session's from the cache file if there is some, else from x.com"
+        with _material_lock(self.path):
+            cached = self._cached(newer_than)
+            if cached is not None:
+                return cached
+            fetched_at = time.time()
+            return self._fetch(), fetched_at
+
+    def _use(self, ct: x_client_transaction.ClientTransaction, fetched_at: float):
+        self._ct = ct
+        self._fetched_at = fetched_at
+        self._next_check = fetched_at + self.ttl
+
+    def _refresh_in_background(self):
+        def refresh():
+            try:
+                ct, fetched_at = self._fresh(newer_than=time.time() - self.ttl)
+                with self._lock:
+                    if self._ct is not None: # not invalidated meanwhile, that material may be the rejected one
+                        self._use(ct, fetched_at)
+            except Exception as e:
+                print(f"Failed to refresh client transaction: {e}")
+                with self._lock:
+                    self._next_check = time.time() + TRANSACTION_RETRY
+            finally:
+                self._refreshing = False
+        self._refreshing = True
+        threading.Thread(target=refresh, daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        "Whether get() can answer without reading the cache file or fetching x.com"
+        return self._ct is not None
+
+    def get(self) -> x_client_transaction.ClientTransaction:
+        with self._lock:
+            if self._ct is None:
+                self._use(*(self._cached() or self._fresh())) # a stale copy is used while it refreshes below
+            if time.time() > self._next_check and not self._refreshing:
+                self._refresh_in_background()
+            return self._ct
+
+    def invalidate(self, before: Optional[float] = None):
+        """
+        Drop the current generator, e.g. after x.com starts rejecting our transaction ids.
+        With before (when the rejected request was sent) material fetched since is kept, so a burst of
+        rejections of requests that were in flight together only refetches once.
+        """
+        with self._lock:
+            if before is not None and self._fetched_at > before:
+                return
+            self._ct = None
+            with _material_lock(self.path):
+                # another session may have replaced the rejected material already
+                if before is None or self._cached(newer_than=before) is None:
+                    self.path.unlink(missing_ok=True)
+
+    def generate_transaction_id(self, method: str, path: str) -> str:
+        return self.get().generate_transaction_id(method=method, path=path)
@@ -1,39 +1,222 @@
-import re, json
+import re, json, queue, threading, time, datetime, contextvars
 from pathlib import Path
-from typing import Iterable, List, Dict, Any, Tuple, TypedDict, Optional
-# from .scraper import Tweet
-import bs4
-import x_client_transaction
-
-class Tweet(TypedDict):
-    tweet_id: str
-    views: str
-    quotes: int
-    replies: int
-    retweets: int
-    likes: int
-    created_at: str
-    text: str
-    bookmarks: int
-    lang: str
-    
-    user_id: str # technically user_rest_id
-    user_name: str
-    user_screen_name: str
-    user_bio: str
-
-    user_avatar: str
-    user_created_at: str
-    user_followers_count: int
-    user_friends_count: int
-    user_favourites_count: int
-    user_is_blue_verified: bool
-
-    post_image_description: Optional[str]
-    post_video_description: Optional[str]
-    replying_to: Optional[str] 
-    quoted_tweet: Optional["Tweet"]
-    retweeted_tweet: Optional["Tweet"]
+from typing import Iterable, Iterator, List, Dict, Any, Tuple, Optional, Union
+import numpy as np
+
+class Tweet:
+    """
+    Compact tweet record. Fields live in __slots__ instead of a per-tweet dict,
+    but dict-style access (tweet["likes"], .get, .keys, "x" in tweet) still works
+    so code written against the old TypedDict keeps working.
+    """
+    __slots__ = (
+        "tweet_id", "views", "quotes", "replies", "retweets", "likes", "created_at", "text", "bookmarks", "lang",
+        "user_rest_id", "user_name", "user_screen_name", "user_bio",
+        "post_image_description", "post_video_description", "replying_to", "quoted_tweet", "retweeted_tweet",
+    )
+
+    def __init__(self, tweet_id: str, text: str, created_at: str, lang: str = "", views: str = "?", likes: int = 0, replies: int = 0, retweets: int = 0, quotes: int = 0, bookmarks: int = 0,
+                 user_rest_id: str = "", user_name: str = "", user_screen_name: str = "", user_bio: str = "",
+                 post_image_description: Optional[str] = None, post_video_description: Optional[str] = None, replying_to: Optional[str] = None,
+                 quoted_tweet: Optional["Tweet"] = None, retweeted_tweet: Optional["Tweet"] = None):
+        self.tweet_id = tweet_id
+        self.views = views
+        self.quotes = quotes
+        self.replies = replies
+        self.retweets = retweets
+        self.likes = likes
+        self.created_at = created_at
+        self.text = text
+        self.bookmarks = bookmarks
+        self.lang = lang
+        self.user_rest_id = user_rest_id # technically the user id
+        self.user_name = user_name
+        self.user_screen_name = user_screen_name
+        self.user_bio = user_bio
+        self.post_image_description = post_image_description
+        self.post_video_description = post_video_description
+        self.replying_to = replying_to
+        self.quoted_tweet = quoted_tweet
+        self.retweeted_tweet = retweeted_tweet
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value):
+        if key not in Tweet.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in Tweet.__slots__
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in Tweet.__slots__ else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return Tweet.__slots__
+
+    def items(self):
+        return ((key, getattr(self, key)) for key in Tweet.__slots__)
+
+    def to_dict(self) -> Dict[str, Any]:
+        "Plain (json serialisable) dict, nested tweets included"
+        d = {key: getattr(self, key) for key in Tweet.__slots__}
+        if self.quoted_tweet is not None:
+            d["quoted_tweet"] = self.quoted_tweet.to_dict()
+        if self.retweeted_tweet is not None:
+            d["retweeted_tweet"] = self.retweeted_tweet.to_dict()
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Tweet":
+        d = {key: d[key] for key in cls.__slots__ if key in d}
+        for key in ("quoted_tweet", "retweeted_tweet"):
+            if isinstance(d.get(key), dict):
+                d[key] = cls.from_dict(d[key])
+        return cls(**d)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Tweet):
+            return NotImplemented
+        return all(getattr(self, key) == getattr(other, key) for key in Tweet.__slots__)
+
+    def __repr__(self) -> str:
+        return f"Tweet(tweet_id={self.tweet_id!r}, user_screen_name={self.user_screen_name!r}, text={self.text[:40]!r})"
+
+def _views_to_int(views) -> int:
+    return int(views) if views not in (None, "", "?") else 0
+
+TWITTER_EPOCH_MS = 1288834974657 # snowflake epoch, 2010-11-04T01:42:54.657Z
+PERIOD_UNITS = { # seconds per period metric
+    "minute": 60,
+    "hour": 60 * 60,
+    "day": 24 * 60 * 60,
+    "week": 7 * 24 * 60 * 60,
+    "month": 31 * 24 * 60 * 60,
+    "year": 365 * 24 * 60 * 60,
+}
+
+def snowflake_to_ms(tweet_ids: Union[int, str, Iterable]) -> Union[int, np.ndarray]:
+    """
+    Unix time in milliseconds encoded in tweet ids: (id >> 22) + TWITTER_EPOCH_MS.
+    Takes a single id or an array of ids, and decodes arrays in one vectorized step.
+    Ids from before Nov 2010 are not snowflakes and decode to the snowflake epoch.
+    """
+    if isinstance(tweet_ids, (int, str)):
+        return (int(tweet_ids) >> 22) + TWITTER_EPOCH_MS
+    return (np.asarray(tweet_ids, dtype=np.int64) >> 22) + TWITTER_EPOCH_MS
+
+def snowflake_to_datetime(tweet_id: Union[int, str]) -> datetime.datetime:
+    "UTC time a tweet was posted, from its id alone"
+    return datetime.datetime.fromtimestamp(snowflake_to_ms(tweet_id) / 1000, tz=datetime.timezone.utc)
+
+def ms_to_snowflake(ms: int) -> int:
+    "Smallest tweet id that can have been created at unix time ms, so `id >= ms_to_snowflake(t)` means posted at or after t"
+    return max(int(ms) - TWITTER_EPOCH_MS, 0) << 22
+
+def parse_period(period: str) -> Optional[datetime.timedelta]:
+    """
+    Parse a period like "month=1 week=2" into a timedelta, summing every metric=value token.
+    A bare metric ("week") counts once. "all" or an empty period means no limit and returns None.
+    """
+    if not period or period.strip() == "all":
+        return None
+    seconds = 0.0
+    for token in period.split():
+        metric, _, value = token.partition('=')
+        metric = metric.lower()
+        if metric not in PERIOD_UNITS and metric.endswith('s'):
+            metric = metric[:-1] # days=3
+        if metric not in PERIOD_UNITS:
+            raise ValueError(f"Invalid period: {period}, expected metric=value tokens with metric in {tuple(PERIOD_UNITS)}")
+        seconds += PERIOD_UNITS[metric] * (float(value) if value else 1)
+    return datetime.timedelta(seconds=seconds)
+
+def period_cutoff_id(period: str, now: Optional[float] = None) -> Optional[int]:
+    "Smallest tweet id posted within the period ending now (unix seconds), or None for \"all\""
+    delta = parse_period(period)
+    if delta is None:
+        return None
+    now = time.time() if now is None else now
+    return ms_to_snowflake((now - delta.total_seconds()) * 1000)
+
+def sort_newest_first(tweets: Iterable["Tweet"]) -> List["Tweet"]:
+    "Sort tweets by posting time using their ids, newest first"
+    tweets = list(tweets)
+    ids = np.fromiter((int(t.tweet_id) for t in tweets), dtype=np.int64, count=len(tweets))
+    return [tweets[i] for i in np.argsort(-ids, kind="stable")]
+
+class TweetBatch:
+    """
+    Columnar view over a list of tweets. Engagement counts are held in NumPy arrays
+    so weighting code can work on whole batches instead of looping over dicts.
+    Each column is built on first use and cached, so code that only needs likes pays for one pass.
+    """
+    __slots__ = ("tweets", "_columns")
+
+    def __init__(self, tweets: Iterable[Tweet]):
+        self.tweets: List[Tweet] = list(tweets)
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def _column(self, name: str, values) -> np.ndarray:
+        column = self._columns.get(name)
+        if column is None:
+            column = self._columns[name] = np.fromiter(values, dtype=np.int64, count=len(self.tweets))
+        return column
+
+    @property
+    def tweet_ids(self) -> np.ndarray:
+        return self._column("tweet_ids", (int(t.tweet_id) for t in self.tweets))
+
+    @property
+    def likes(self) -> np.ndarray:
+        return self._column("likes", (t.likes for t in self.tweets))
+
+    @property
+    def replies(self) -> np.ndarray:
+        return self._column("replies", (t.replies for t in self.tweets))
+
+    @property
+    def retweets(self) -> np.ndarray:
+        return self._column("retweets", (t.retweets for t in self.tweets))
+
+    @property
+    def quotes(self) -> np.ndarray:
+        return self._column("quotes", (t.quotes for t in self.tweets))
+
+    @property
+    def views(self) -> np.ndarray:
+        return self._column("views", (_views_to_int(t.views) for t in self.tweets)) # "?" when hidden -> 0
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        "unix ms, decoded from the ids"
+        if "timestamps" not in self._columns:
+            self._columns["timestamps"] = snowflake_to_ms(self.tweet_ids)
+        return self._columns["timestamps"]
+
+    def __len__(self) -> int:
+        return len(self.tweets)
+
+    def __iter__(self):
+        return iter(self.tweets)
+
+    def __getitem__(self, i: int) -> Tweet:
+        return self.tweets[i]
+
+    def select(self, mask_or_indices: np.ndarray) -> "TweetBatch":
+        "Sub-batch from a boolean mask or index array"
+        indices = np.flatnonzero(mask_or_indices) if np.asarray(mask_or_indices).dtype == bool else np.asarray(mask_or_indices)
+        return TweetBatch(self.tweets[i] for i in indices)
+
+    def since(self, period: str, now: Optional[float] = None) -> "TweetBatch":
+        "Sub-batch of the tweets posted within the period"
+        cutoff_id = period_cutoff_id(period, now)
+        return self if cutoff_id is None else self.select(self.tweet_ids >= cutoff_id)
 
 def stringify_tweet(tweet: Tweet):
     full_tweet = []
@@ -50,25 +233,20 @@ def stringify_tweet(tweet: Tweet):
     return "\n".join(full_tweet)
 
 
-def load_secrets():
-    "Load Twitter headers and cookies"
+def load_sessions() -> List[Tuple[Dict[str, str], Dict[str, str]]]:
+    """
+    Load Twitter (headers, cookies) for every account in secrets.json, which holds either a single
+    {"headers": ..., "cookies": ...} object, a list of them, or {"sessions": [...]}
+    """
     with open(Path(__file__).parent / "../secrets.json", "r") as f:
         secrets = json.load(f)
-        cookies = secrets['cookies']
-        headers = secrets['headers']
-    return headers, cookies
-
-def create_client_transaction(client, headers):
-    "Create a client for generating a transaction-id"
-    response = client.get(url="https://x.com", headers=headers)
-    home_page_response = bs4.BeautifulSoup(response.text(), 'html.parser')
-    ondemand_file_url = x_client_transaction.constants.ON_DEMAND_FILE_REGEX.search(str(home_page_response))
-    if not ondemand_file_url:
-        raise Exception("Could not find ondemand.s file")
-    ondemand_file_url = f"https://abs.twimg.com/responsive-web/client-web/ondemand.s.{ondemand_file_url.group(1)}a.js"
-    ondemand_file_response = client.get(url=ondemand_file_url, headers=headers)
-    ondemand_file = bs4.BeautifulSoup(ondemand_file_response.text(), 'html.parser')
-    return x_client_transaction.ClientTransaction(home_page_response=home_page_response, ondemand_file_response=ondemand_file)
+    if isinstance(secrets, dict):
+        secrets = secrets.get('sessions', [secrets])
+    return [(session['headers'], session['cookies']) for session in secrets]
+
+def load_secrets():
+    "Load Twitter headers and cookies of the first session"
+    return load_sessions()[0]
 
 def clean_tweet(t):
     t = re.sub(r"http\S+", "", t)  
@@ -126,7 +304,7 @@ def tweets_to_json(
     indent: int = None
 ) -> str:
     "Field = None for all fields"
-    fields = fields or Tweet.__annotations__.keys()
+    fields = fields or Tweet.__slots__
     
     json_list = []
     for t in tweets:
@@ -194,7 +372,7 @@ def users_to_table(users: Iterable[Dict[str, Any]], include_header: bool = True)
 
 def tweets_to_table(tweets: Iterable[Tweet], fields: List[str] = ["tweet_id", "type", "created_at", "views", "likes", "retweets", "quotes", "replies", "text", "media", "ref"]) -> str:
     "Field = None for all fields"
-    fields = fields or Tweet.__annotations__.keys()
+    fields = fields or Tweet.__slots__
     table_rows: List[str] = [DELIM.join(fields)]
     for t in tweets:
         row = []
@@ -209,13 +387,54 @@ def tweets_to_table(tweets: Iterable[Tweet], fields: List[str] = ["tweet_id", "t
             elif field == "text":
                 field_value = _sanitize(t["text"])
             else:
-                field_value = _sanitize(getattr(t, field_map[field], ""))
+                field_value = _sanitize(t.get(field, ""))
             row.append(field_value)
 
         table_rows.append(DELIM.join(row))
     
     return "\n".join(table_rows)
 
+def prefetch(iterable: Iterable, depth: int = 1) -> Iterator:
+    """
+    Iterate in a background thread, keeping up to `depth` items ready, so producing the next item
+    (e.g. fetching the next page) overlaps with consuming the current one (e.g. scoring it).
+    """
+    ready = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)): break
+            else:
+                put((end, None))
+        except Exception as e:
+            put((end, e))
+        finally:
+            if hasattr(iterator, "close"): iterator.close()
+
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start() # keeps e.g. RequestScheduler.track
+    try:
+        while True:
+            item, error = ready.get()
+            if item is end:
+                if error: raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
 def write_to_file(content): # For debugging
     with open(Path(__file__).parent / "twitter.txt", "w") as f:
         json.dump(content,f, indent=5)
\ No newline at end of file